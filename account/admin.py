@@ -21,6 +21,6 @@ class UserAdmin(DjangoUserAdmin):
             'fields': ('email', 'password1', 'password2'),
         }),
     )
-    list_display = ('email', 'is_staff', 'is_active')
+    list_display = ('email', 'posts_count', 'is_staff', 'is_active')
     search_fields = ('email',)
     ordering = ('email',)
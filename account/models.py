@@ -41,11 +41,24 @@ class CustomUserManager(BaseUserManager):
 class CustomUser(AbstractUser):
     """
     Custom User. Allows you to use an email instead of a username.
+    'posts_count' is the number of the user's posts, it is updated when posts are created or deleted.
+    'posts_edits' is incremented when a post of the user is edited, it is part of the version marker of his posts.
+    'followers_count' and 'following_count' are the numbers of the user's followers and subscriptions,
+    they are updated when subscriptions are created or deleted.
     """
     username = None
     email = models.EmailField(unique=True)
+    posts_count = models.IntegerField(default=0)
+    posts_edits = models.PositiveIntegerField(default=0)
+    followers_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
     objects = CustomUserManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['posts_count', 'id'], name='user_posts_count_idx'),
+        ]
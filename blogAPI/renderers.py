@@ -0,0 +1,133 @@
+from decimal import Decimal
+
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Types that never contain floats, has_floats() does not look into them.
+SCALARS = {str, int, bool, type(None)}
+
+# The fields whose representation is never a float, the decimals are refused by the default hook of orjson.
+FLOAT_FREE_FIELDS = (
+    serializers.BooleanField, serializers.CharField, serializers.IntegerField, serializers.DecimalField,
+    serializers.UUIDField,
+    serializers.DateField, serializers.DateTimeField, serializers.TimeField, serializers.DurationField,
+    serializers.PrimaryKeyRelatedField, serializers.StringRelatedField, serializers.HyperlinkedRelatedField,
+)
+
+
+def emits_floats(field):
+    """
+    Tells whether the representation of the serializer or the field may contain floats:
+    the float fields and the fields whose values are not known (method fields, JSON fields...).
+    """
+    if isinstance(field, (serializers.ListSerializer, serializers.ListField, serializers.DictField)):
+        return emits_floats(field.child)
+    if isinstance(field, serializers.ManyRelatedField):
+        return emits_floats(field.child_relation)
+    if isinstance(field, serializers.Serializer):
+        return any(emits_floats(child) for child in field.fields.values() if not child.write_only)
+    return not isinstance(field, FLOAT_FREE_FIELDS)
+
+
+def has_floats(data):
+    """
+    Tells whether the data contains floats or decimals, orjson writes them differently from the json module
+    (1e-7 for 1e-07, null for NaN). Only the values of the lists and dictionaries are looked into,
+    the data of the serializers that emit no floats (ReturnDict, ReturnList) is not.
+    FastJSONRenderer finds the decimals of such data while encoding.
+    """
+    serializer = getattr(data, 'serializer', None)
+    if serializer is not None and not emits_floats(serializer):
+        return False
+    if isinstance(data, dict):
+        items = data.values()
+    elif isinstance(data, (list, tuple)):
+        items = data
+    else:
+        return isinstance(data, (float, Decimal))
+    for item in items:
+        if type(item) not in SCALARS and has_floats(item):
+            return True
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON renderer encoding with orjson when it is installed, the output is the same as JSONRenderer's.
+    Without orjson, for the output orjson can not produce (indentation, ASCII only, not compact)
+    and for the data it writes differently (floats, integers over 64 bits, keys other than strings),
+    JSONRenderer renders the data. The dates and the types unknown to orjson are encoded by the JSON encoder of DRF.
+    The data is looked into for floats unless it is the data of a serializer that emits no floats.
+    stream() renders a list item by item.
+    """
+    # Chunk of the streamed list, in items.
+    stream_chunk_size = 100
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or not self.use_orjson(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        return self.encode(data, accepted_media_type, renderer_context)
+
+    def use_orjson(self, accepted_media_type=None, renderer_context=None):
+        return orjson is not None and self.encoder_class is JSONEncoder and not self.ensure_ascii and \
+            self.compact and self.get_indent(accepted_media_type, renderer_context or {}) is None
+
+    def encode(self, data, accepted_media_type=None, renderer_context=None, walk=True):
+        """
+        Encodes the data with orjson. The data is walked for floats when walk is true,
+        the decimals are found by the default hook, they abort the encoding.
+        """
+        if walk and has_floats(data):
+            return JSONRenderer.render(self, data, accepted_media_type, renderer_context)
+        default = self.encoder_class().default
+
+        def encode_default(obj):
+            if isinstance(obj, Decimal):
+                raise TypeError('Decimals are rendered by JSONRenderer')
+            return default(obj)
+
+        try:
+            ret = orjson.dumps(data, default=encode_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return JSONRenderer.render(self, data, accepted_media_type, renderer_context)
+        # The same escaping of the line separators as JSONRenderer, they are invalid in JavaScript strings.
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+    def stream(self, items, accepted_media_type=None, renderer_context=None, serializer=None):
+        """
+        Yields the JSON list of the items a chunk at a time, the items are read from the iterable
+        as the chunks are sent. The joined chunks are the same as the rendered list.
+        An indented list is rendered at once.
+        The items made by a serializer that emits no floats are not looked into for floats.
+        """
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context) is not None:
+            yield super().render(list(items), accepted_media_type, renderer_context)
+            return
+        if self.use_orjson(accepted_media_type, renderer_context):
+            walk = serializer is None or emits_floats(serializer)
+
+            def encode(item):
+                return self.encode(item, accepted_media_type, renderer_context, walk)
+        else:
+            def encode(item):
+                if item is None:
+                    return b'null'
+                return JSONRenderer.render(self, item, accepted_media_type, renderer_context)
+        separator = b',' if self.compact else b', '
+        chunk, prefix = [], b'['
+        for item in items:
+            chunk.append(encode(item))
+            if len(chunk) == self.stream_chunk_size:
+                yield prefix + separator.join(chunk)
+                chunk, prefix = [], separator
+        if chunk:
+            yield prefix + separator.join(chunk) + b']'
+        else:
+            yield b'[]' if prefix == b'[' else b']'
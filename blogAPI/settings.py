@@ -131,7 +131,7 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
-    'DEFAULT_RENDERER_CLASSES': ('rest_framework.renderers.JSONRenderer',),
+    'DEFAULT_RENDERER_CLASSES': ('blogAPI.renderers.FastJSONRenderer',),
     'DEFAULT_AUTHENTICATION_CLASSES': ('knox.auth.TokenAuthentication',),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -143,6 +143,51 @@ REST_KNOX = {
     'AUTO_REFRESH': False,
 }
 
+# Not paginated lists longer than this are streamed (see StreamingListMixin).
+STREAMING_LIST_THRESHOLD = 1000
+
+# Maximum number of posts created by one bulk request.
+POST_BULK_CREATE_MAX = 100
+
+# Number of posts read from the database at a time by the export.
+POST_EXPORT_CHUNK_SIZE = 2000
+
+# Posts older than this are moved to the archive by "manage.py archive_posts", they stay read or unread in the feeds.
+# None (0 days in the environment) - no archive. Turning it off hides the archived posts,
+# run "manage.py rebuild_unread_counts" after it.
+POST_ARCHIVE_AGE = timedelta(days=int(os.getenv("POST_ARCHIVE_DAYS", 0))) or None
+# Number of posts moved to the archive per transaction.
+POST_ARCHIVE_BATCH_SIZE = 1000
+
+# Post texts longer than this many characters are stored compressed, None (0 in the environment) turns it off.
+# Run "manage.py compress_post_texts" after changing it. Only SQLite compresses, other databases store the texts as is.
+POST_TEXT_COMPRESS_SIZE = int(os.getenv("POST_TEXT_COMPRESS_SIZE", 0)) or None
+
+# Post feed
+# Number of rows written per INSERT when delivering a new post to the followers' feeds.
+FEED_FAN_OUT_BATCH_SIZE = 1000
+# Posts of users with at least this many followers are not delivered to the feeds,
+# they are merged into the feed when it is read. None (0 in the environment) - always deliver.
+FEED_FAN_OUT_THRESHOLD = int(os.getenv("FEED_FAN_OUT_THRESHOLD", 10000)) or None
+# Number of the latest posts of a user added to the feed when subscribing to him. 0 - none.
+FEED_FOLLOW_BACKFILL = int(os.getenv("FEED_FOLLOW_BACKFILL", 0))
+# Reading a feed that was updated longer ago than this adds the posts missing from it,
+# for example timedelta(minutes=5). None - reading the feed never writes to the database.
+FEED_REFRESH_INTERVAL = None
+# Seconds a rendered feed page is kept in the cache. 0 - pages are not cached.
+# The pages are kept in the default cache (memory of each process unless CACHES is configured),
+# the markers invalidating them and the hit and miss counters are shared by all processes in the database.
+FEED_CACHE_TIMEOUT = int(os.getenv("FEED_CACHE_TIMEOUT", 60))
+# Hits and misses counted by a process before they are added to the shared counters,
+# the counts not added yet are lost when the process stops.
+FEED_CACHE_STATS_BATCH = 100
+# Number of posts removed from a feed per transaction after unsubscribing.
+FEED_PURGE_BATCH_SIZE = 1000
+# A background feed job is retried until it fails this many times.
+FEED_JOB_MAX_ATTEMPTS = 5
+# How long a worker owns a job before other workers may take it over.
+FEED_JOB_LOCK_TIMEOUT = timedelta(minutes=10)
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'blog API',
     'DESCRIPTION': 'Blog backend with REST API',
@@ -1,17 +1,24 @@
 from django.contrib import admin
 
-from post.models import Post, UserFollowing, UserFeed
+from post.models import Post, UserFollowing, UserFeed, FeedJob
+from post.search import search_posts
 
 
 class PostAdmin(admin.ModelAdmin):
     """
     Manage User posts.
+    The title and text are searched with the search index of the database.
     """
     list_display = ('id', 'title', 'owner', 'date_create')
     list_display_links = ('id', 'title')
-    search_fields = ('title', 'text', 'owner')
+    search_fields = ('title', 'text')
     list_filter = ('date_create',)
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return search_posts(queryset, search_term, rank=False), False
+
 
 class UserFollowingAdmin(admin.ModelAdmin):
     """
@@ -33,6 +40,16 @@ class UserFeedAdmin(admin.ModelAdmin):
     list_filter = ('date_update',)
 
 
+class FeedJobAdmin(admin.ModelAdmin):
+    """
+    Background feed jobs management.
+    """
+    list_display = ('id', 'action', 'user', 'author', 'created', 'attempts')
+    list_display_links = ('id', 'action')
+    list_filter = ('action', 'created')
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(UserFollowing, UserFollowingAdmin)
 admin.site.register(UserFeed, UserFeedAdmin)
+admin.site.register(FeedJob, FeedJobAdmin)
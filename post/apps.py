@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class PostConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'post'
+
+    def ready(self):
+        from post.fields import setup_decompress
+        from post.search import setup_search
+        connection_created.connect(setup_decompress)
+        post_migrate.connect(setup_search, sender=self)
@@ -0,0 +1,99 @@
+from collections import Counter
+from hashlib import md5
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Subquery
+from django.db.models.functions import Coalesce
+from django.utils.http import quote_etag
+
+from post.models import FeedCacheState
+
+# Hits and misses counted by this process and not yet added to the shared row.
+pending = Counter()
+pending_lock = Lock()
+
+
+def feed_cache_pulled():
+    """
+    Returns the expression of the shared marker of the not pushed posts, the feed is fetched with it
+    as 'pulled' so that building the cache key needs no query.
+    """
+    state = FeedCacheState.objects.filter(pk=FeedCacheState.ROW_ID).values('pulled')
+    return Coalesce(Subquery(state), 0)
+
+
+def feed_cache_key(request, obj):
+    """
+    Returns the cache key of the feed page: the user, the feed version,
+    the marker of the not pushed posts ('pulled' of the feed, see feed_cache_pulled())
+    and the full URL with the filter and the cursor.
+    """
+    url = md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'post-feed:{obj.pk}:{obj.version}:{obj.pulled}:{url}'
+
+
+def feed_cache_pulled_changed():
+    """
+    Invalidates the cached pages of all feeds when not pushed posts ('fan_out' = False) are created
+    or deleted, because they do not change the versions of the feeds.
+    The marker is a database row, it is moved together with the posts by the same transaction.
+    """
+    FeedCacheState.add(pulled=1)
+
+
+def feed_cache_get(key):
+    """
+    Returns the cached feed page or None, counts the hit or the miss.
+    """
+    data = cache.get(key)
+    feed_cache_count('misses' if data is None else 'hits')
+    return data
+
+
+def feed_cache_set(key, data):
+    """
+    Saves the feed page for FEED_CACHE_TIMEOUT seconds.
+    """
+    cache.set(key, data, settings.FEED_CACHE_TIMEOUT)
+
+
+def feed_cache_count(name):
+    """
+    Counts the hit or the miss ('hits', 'misses'). The counts of the process are added to the shared row
+    every FEED_CACHE_STATS_BATCH counts, so most reads of the cache write nothing.
+    """
+    with pending_lock:
+        pending[name] += 1
+        flush = sum(pending.values()) >= settings.FEED_CACHE_STATS_BATCH
+    if flush:
+        feed_cache_flush()
+
+
+def feed_cache_flush():
+    """
+    Adds the hits and misses counted by this process to the shared row.
+    """
+    with pending_lock:
+        counts = dict(pending)
+        pending.clear()
+    if counts:
+        FeedCacheState.add(**counts)
+
+
+def feed_cache_stats():
+    """
+    Returns the number of hits and misses of the feed page cache of all processes:
+    the shared row plus the counts of this process not added to it yet.
+    """
+    state = FeedCacheState.objects.filter(pk=FeedCacheState.ROW_ID).values_list('hits', 'misses').first()
+    hits, misses = state or (0, 0)
+    return hits + pending['hits'], misses + pending['misses']
+
+
+def make_etag(*parts):
+    """
+    Returns a strong ETag built from the version markers of the response.
+    """
+    return quote_etag(md5(':'.join(str(part) for part in parts).encode()).hexdigest())
@@ -0,0 +1,91 @@
+import base64
+import math
+import zlib
+
+from django.conf import settings
+from django.db import models
+
+# Compressed values are stored as the prefix followed by the base85 encoded zlib data.
+COMPRESSED_PREFIX = 'zlib:'
+DECOMPRESS_FUNCTION = 'post_decompress'
+
+
+def compress(text, size):
+    """
+    Compresses the text if it is longer than 'size' characters and compression makes it shorter.
+    Texts starting with the prefix are always compressed, so every stored value starting with it is compressed.
+    """
+    if text is None or (len(text) <= size and not text.startswith(COMPRESSED_PREFIX)):
+        return text
+    value = COMPRESSED_PREFIX + base64.b85encode(zlib.compress(text.encode())).decode('ascii')
+    if len(value) < len(text) or text.startswith(COMPRESSED_PREFIX):
+        return value
+    return text
+
+
+def decompress(value):
+    """
+    Returns the text of a stored value, compressed or not.
+    """
+    if value is None or not value.startswith(COMPRESSED_PREFIX):
+        return value
+    return zlib.decompress(base64.b85decode(value[len(COMPRESSED_PREFIX):])).decode()
+
+
+def stores_compressed(connection):
+    """
+    Only SQLite stores compressed texts, the queries decompress them with the registered function.
+    """
+    return connection.vendor == 'sqlite'
+
+
+def compress_size(connection):
+    """
+    Returns the size of the texts compressed on the database connection.
+    """
+    if settings.POST_TEXT_COMPRESS_SIZE is None or not stores_compressed(connection):
+        return math.inf
+    return settings.POST_TEXT_COMPRESS_SIZE
+
+
+class CompressedTextField(models.TextField):
+    """
+    Text field compressing the texts longer than settings.POST_TEXT_COMPRESS_SIZE characters,
+    the texts are decompressed when the column is read, deferred columns are never decompressed.
+    The setting None turns the compression off, the compressed values are still read.
+    Other databases than SQLite store the texts as is, even the ones starting with the prefix,
+    because their queries can not decompress them (PostgreSQL already compresses large values, TOAST).
+    """
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if prepared or not stores_compressed(connection):
+            return value
+        return compress(value, compress_size(connection))
+
+    def from_db_value(self, value, expression, connection):
+        return decompress(value) if stores_compressed(connection) else value
+
+
+class Decompress(models.Func):
+    """
+    The text of a compressed column in the database queries, such as Substr(Decompress('text'), 1, 100).
+    SQLite calls the registered decompress function, other databases store the texts as is.
+    """
+    function = DECOMPRESS_FUNCTION
+    output_field = models.TextField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return compiler.compile(self.get_source_expressions()[0])
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, **extra_context)
+
+
+def setup_decompress(sender, connection, **kwargs):
+    """
+    Registers the decompress function on the new SQLite connections, the search index triggers use it.
+    Connected to the 'connection_created' signal.
+    """
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(DECOMPRESS_FUNCTION, 1, decompress, deterministic=True)
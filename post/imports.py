@@ -0,0 +1,260 @@
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import F, Q, Max
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from post.cache import feed_cache_pulled_changed
+from post.models import Post, UserFeed, UserFollowing
+from post.utils import feed_unread_pushed_count, user_counters_reconcile
+
+UserModel = get_user_model()
+
+def read_records(path, fmt=None):
+    """
+    Yields the records of an NDJSON or CSV file one at a time, the format is taken from the file extension
+    if not given. Empty CSV values are left out of the records.
+    """
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    with open(path, newline='', encoding='utf-8') as file:
+        if fmt == 'csv':
+            for record in csv.DictReader(file):
+                yield {key: value for key, value in record.items() if value != ''}
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value
+    date = parse_datetime(value)
+    if date is None:
+        raise ValueError(f'Invalid date "{value}"')
+    return timezone.make_aware(date) if timezone.is_naive(date) else date
+
+
+def make_user(record):
+    """
+    The password of the record is kept if it is a Django password hash, other passwords are hashed
+    (slow, export the hashes if you can), users without a password can not log in.
+    """
+    password = record.get('password')
+    if password is None:
+        password = make_password(None)
+    else:
+        try:
+            identify_hasher(password)
+        except ValueError:
+            password = make_password(password)
+    user = UserModel(email=UserModel.objects.normalize_email(record['email']), password=password,
+                     first_name=record.get('first_name', ''), last_name=record.get('last_name', ''))
+    if 'id' in record:
+        user.id = int(record['id'])
+    if 'date_joined' in record:
+        user.date_joined = parse_date(record['date_joined'])
+    return user
+
+
+def make_post(record):
+    post = Post(title=record['title'], text=record['text'], owner_id=int(record['owner']))
+    if 'id' in record:
+        post.id = int(record['id'])
+    if 'date_create' in record:
+        post.date_create = parse_date(record['date_create'])
+    return post
+
+
+def make_follow(record):
+    follow = UserFollowing(user_id=int(record['user']), following_user_id=int(record['following_user']))
+    if follow.user_id == follow.following_user_id:
+        return None
+    if 'created' in record:
+        follow.created = parse_date(record['created'])
+    return follow
+
+
+IMPORTS = {
+    'users': (UserModel, make_user),
+    'posts': (Post, make_post),
+    'follows': (UserFollowing, make_follow),
+}
+
+
+def auto_dates(model):
+    """
+    Returns the attnames of the auto_now_add dates of the model.
+    The rows are written as they are, the dates are set on the objects.
+    """
+    return [field.attname for field in model._meta.concrete_fields if getattr(field, 'auto_now_add', False)]
+
+
+def ids_table(model, connection):
+    """
+    Creates an empty temporary table of the ids of the imported rows of the model, returns its quoted name.
+    """
+    name = connection.ops.quote_name(f'{model._meta.db_table}_imported')
+    drop = {
+        'postgresql': f'DROP TABLE IF EXISTS pg_temp.{name}',
+        'mysql': f'DROP TEMPORARY TABLE IF EXISTS {name}',
+    }.get(connection.vendor, f'DROP TABLE IF EXISTS temp.{name}')
+    with connection.cursor() as cursor:
+        cursor.execute(drop)
+        cursor.execute(f'CREATE TEMPORARY TABLE {name} (id bigint PRIMARY KEY)')
+    return name
+
+
+def copy_rows(table, columns, rows, connection):
+    """
+    Writes the rows with a single COPY statement (PostgreSQL).
+    """
+    buffer = io.StringIO()
+    # Strings are quoted, unquoted empty values are NULL.
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    writer.writerows(rows)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def insert_rows(model, objs, connection, ignore_conflicts=False):
+    """
+    Writes the objects as they are, no field sets its value on save.
+    The primary key is written if the objects have one.
+    COPY on PostgreSQL (into a temporary table first when the conflicting rows are skipped),
+    a multi-row insert on the other databases.
+    Returns the number of written rows, the rows conflicting with 'ignore_conflicts' are skipped.
+    """
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key or objs[0].pk is not None]
+    rows = [[field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] for obj in objs]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            if not ignore_conflicts:
+                copy_rows(table, columns, rows, connection)
+                return len(rows)
+            stage = connection.ops.quote_name(f'{model._meta.db_table}_stage')
+            cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {stage} ON COMMIT DELETE ROWS '
+                           f'AS SELECT {columns} FROM {table} WITH NO DATA')
+            copy_rows(stage, columns, rows, connection)
+            cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage} ON CONFLICT DO NOTHING')
+            cursor.execute(f'TRUNCATE {stage}')
+        else:
+            placeholders = ', '.join(['%s'] * len(fields))
+            cursor.executemany(f'{connection.ops.insert_statement(ignore_conflicts=ignore_conflicts)} {table} '
+                               f'({columns}) VALUES ({placeholders}) '
+                               f'{connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=ignore_conflicts)}',
+                               rows)
+        return cursor.rowcount
+
+
+def import_records(kind, records, batch_size, progress=None):
+    """
+    Writes the records of 'kind' (users, posts or follows) in batches of 'batch_size',
+    duplicate subscriptions are skipped.
+    'progress' is called with the number of written rows and the elapsed seconds after every batch.
+    Returns the number of written rows, the number of skipped rows and the temporary table
+    of the ids of the written rows (see ids_table()).
+    """
+    model, make = IMPORTS[kind]
+    connection = connections[model.objects.db]
+    start = time.monotonic()
+    count, skipped, explicit_ids = 0, 0, False
+    table = ids_table(model, connection)
+    dates = auto_dates(model)
+    before = model.objects.aggregate(id=Max('id'))['id'] or 0
+    records = iter(records)
+    while True:
+        objs = [obj for obj in map(make, islice(records, batch_size)) if obj is not None]
+        if not objs:
+            break
+        now = timezone.now()
+        for obj in objs:
+            for date in dates:
+                if getattr(obj, date) is None:
+                    setattr(obj, date, now)
+        # The rows with ids are written apart from the rows whose ids are generated by the database.
+        with_ids = [obj for obj in objs if obj.pk is not None]
+        without_ids = [obj for obj in objs if obj.pk is None]
+        with transaction.atomic(using=connection.alias):
+            written = 0
+            for group in (with_ids, without_ids):
+                if group:
+                    written += insert_rows(model, group, connection, ignore_conflicts=kind == 'follows')
+            if with_ids:
+                explicit_ids = True
+                with connection.cursor() as cursor:
+                    cursor.executemany(f'INSERT INTO {table} (id) VALUES (%s)', [[obj.pk] for obj in with_ids])
+        count += written
+        skipped += len(objs) - written
+        if progress is not None:
+            progress(count, time.monotonic() - start)
+    if explicit_ids:
+        # The id sequence is moved past the written ids.
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+                cursor.execute(sql)
+    # The rows with ids generated by the database are after the previous last id.
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {table} (id) SELECT id FROM {connection.ops.quote_name(model._meta.db_table)} t '
+                       f'WHERE t.id > %s '
+                       f'AND NOT EXISTS (SELECT 1 FROM {table} i WHERE i.id = t.id)', [before])
+    return count, skipped, table
+
+
+def import_finish(posts=None, follows=None):
+    """
+    Brings the data related to the imported posts and subscriptions (the temporary tables of their ids
+    returned by import_records(), None if nothing was imported) up to date with set-based statements,
+    whatever the number of imported rows is:
+    the users' counters are recounted, the posts of users with at least FEED_FAN_OUT_THRESHOLD followers
+    are marked as not pushed, the followers get their feeds, the pushed posts created after the moment
+    of subscription are added to the feeds and the feeds' unread counters are recounted.
+    """
+    connection = connections[Post.objects.db]
+    posts = posts or ids_table(Post, connection)
+    follows = follows or ids_table(UserFollowing, connection)
+    imported_posts = Post.objects.filter(id__in=RawSQL(f'SELECT id FROM {posts}', ()))
+    imported_follows = UserFollowing.objects.filter(id__in=RawSQL(f'SELECT id FROM {follows}', ()))
+    user_counters_reconcile(UserModel.objects.filter(Q(pk__in=imported_posts.values('owner')) |
+                                                     Q(pk__in=imported_follows.values('user')) |
+                                                     Q(pk__in=imported_follows.values('following_user'))).
+                            values('pk'))
+    threshold = settings.FEED_FAN_OUT_THRESHOLD
+    if threshold is not None and imported_posts.filter(owner__followers_count__gte=threshold). \
+            update(fan_out=False):
+        feed_cache_pulled_changed()
+
+    post, follow, feed = Post._meta.db_table, UserFollowing._meta.db_table, UserFeed._meta.db_table
+    through = UserFeed.feed.through._meta.db_table
+    imported = f'(p.id IN (SELECT id FROM {posts}) OR f.id IN (SELECT id FROM {follows}))'
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {feed} (user_id, date_update, unread_count, version) '
+                       f'SELECT DISTINCT f.user_id, %s, 0, 0 FROM {follow} f '
+                       f'WHERE (f.id IN (SELECT id FROM {follows}) OR EXISTS (SELECT 1 FROM {post} p '
+                       f'WHERE p.owner_id = f.following_user_id AND p.id IN (SELECT id FROM {posts}))) '
+                       f'AND NOT EXISTS (SELECT 1 FROM {feed} u WHERE u.user_id = f.user_id)',
+                       [timezone.now()])
+        cursor.execute(f'INSERT INTO {through} (userfeed_id, post_id, date_create) '
+                       f'SELECT f.user_id, p.id, p.date_create FROM {follow} f '
+                       f'JOIN {post} p ON p.owner_id = f.following_user_id AND p.date_create >= f.created '
+                       f'WHERE p.fan_out AND {imported} '
+                       f'AND NOT EXISTS (SELECT 1 FROM {through} t WHERE t.userfeed_id = f.user_id '
+                       f'AND t.post_id = p.id)')
+        feeds = UserFollowing.objects.filter(Q(pk__in=imported_follows.values('pk')) |
+                                             Q(following_user__in=imported_posts.values('owner'))).values('user')
+        UserFeed.objects.filter(pk__in=feeds).update(unread_count=feed_unread_pushed_count(),
+                                                     version=F('version') + 1)
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from post.models import FeedJob
+from post.utils import feed_purge
+
+
+def run_job(job, batch_size=None):
+    """
+    Runs the job with the handler of its action.
+    """
+    if job.action == FeedJob.PURGE:
+        feed_purge(job.user_id, job.author_id, batch_size or settings.FEED_PURGE_BATCH_SIZE)
+    else:
+        raise ValueError(f'Unknown feed job action: {job.action}')
+
+
+def claim_job():
+    """
+    Takes the oldest free job and locks it for FEED_JOB_LOCK_TIMEOUT, or returns None.
+    Rows locked by other workers are skipped, so many workers can run at once.
+    A job whose worker has died is taken over after its lock expires.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job = FeedJob.objects.select_for_update(skip_locked=True). \
+            filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+                   attempts__lt=settings.FEED_JOB_MAX_ATTEMPTS).first()
+        if job is None:
+            return None
+        job.locked_until = now + settings.FEED_JOB_LOCK_TIMEOUT
+        job.attempts += 1
+        job.save(update_fields=['locked_until', 'attempts'])
+    return job
+
+
+def run_next_job(batch_size=None):
+    """
+    Claims and runs one job. The job is deleted when it is done,
+    a failed job keeps its lock with the error saved and is retried after the lock expires.
+    Returns the job or None if the queue is empty.
+    """
+    job = claim_job()
+    if job is None:
+        return None
+    try:
+        run_job(job, batch_size)
+    except Exception as error:
+        FeedJob.objects.filter(pk=job.pk).update(error=repr(error))
+        job.error = repr(error)
+    else:
+        FeedJob.objects.filter(pk=job.pk).delete()
+    return job
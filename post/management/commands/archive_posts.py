@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from post.utils import posts_archive
+
+
+class Command(BaseCommand):
+    """
+    Moves the posts older than POST_ARCHIVE_AGE from the post table into the archive together with
+    their rows of the feeds, so the post and feed tables keep only the recent posts.
+    The lists read the archive only when they are paginated past the recent posts. Run it periodically.
+    """
+    help = 'Moves the posts older than POST_ARCHIVE_AGE into the archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.POST_ARCHIVE_BATCH_SIZE,
+                            help='Number of posts moved per transaction.')
+
+    def handle(self, *args, **options):
+        if settings.POST_ARCHIVE_AGE is None:
+            raise CommandError('The archive is turned off, set POST_ARCHIVE_AGE.')
+        count = posts_archive(timezone.now() - settings.POST_ARCHIVE_AGE, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {count} posts.'))
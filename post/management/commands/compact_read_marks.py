@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from post.models import UserFeed
+from post.utils import feed_compact_read
+
+
+class Command(BaseCommand):
+    """
+    Moves the 'read_until' mark of the feeds up to their oldest unread post
+    and removes the posts covered by the mark from the "read" field.
+    Run it once to migrate the existing "read" data, then periodically
+    to keep the "read" field small.
+    """
+    help = "Moves the feeds' read marks up and removes the covered posts from the 'read' field."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='Compact the feed of the user with this id only. Can be repeated.')
+
+    def handle(self, *args, **options):
+        feeds = UserFeed.objects.all()
+        if options['users']:
+            feeds = feeds.filter(pk__in=options['users'])
+        count = 0
+        for obj in feeds.iterator():
+            feed_compact_read(obj)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Compacted {count} feeds.'))
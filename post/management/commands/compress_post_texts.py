@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from post.utils import posts_compress_texts
+
+
+class Command(BaseCommand):
+    """
+    Compresses the stored texts of the existing posts longer than settings.POST_TEXT_COMPRESS_SIZE,
+    or decompresses them when the setting is None.
+    Run it once after changing the setting, the new and updated posts are stored according to it.
+    """
+    help = 'Compresses or decompresses the stored texts of the posts according to POST_TEXT_COMPRESS_SIZE.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of posts rewritten per query.')
+
+    def handle(self, *args, **options):
+        count = posts_compress_texts(options['batch_size'])
+        action = 'Decompressed' if settings.POST_TEXT_COMPRESS_SIZE is None else 'Compressed'
+        self.stdout.write(self.style.SUCCESS(f'{action} the texts of {count} posts.'))
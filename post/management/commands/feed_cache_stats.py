@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from post.cache import feed_cache_stats
+
+
+class Command(BaseCommand):
+    """
+    Displays the hit and miss counters of the feed page cache.
+    """
+    help = 'Displays the hit and miss counters of the feed page cache.'
+
+    def handle(self, *args, **options):
+        hits, misses = feed_cache_stats()
+        total = hits + misses
+        ratio = hits / total * 100 if total else 0
+        self.stdout.write(f'Hits: {hits}, misses: {misses}, hit ratio: {ratio:.1f}%.')
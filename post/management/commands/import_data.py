@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from post.imports import import_finish, import_records, read_records
+
+
+class Command(BaseCommand):
+    """
+    Imports users, posts and subscriptions from NDJSON or CSV files, one record per line:
+    users - email, optional id, password (a Django password hash), first_name, last_name, date_joined;
+    posts - title, text, owner (user id), optional id, date_create;
+    follows - user, following_user (user ids), optional created, duplicate subscriptions are skipped.
+    The files are read as streams and written in batches, then the counters and the feeds
+    of the imported posts and subscriptions are built.
+    """
+    help = 'Imports users, posts and subscriptions from NDJSON or CSV files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', help='File of the users.')
+        parser.add_argument('--posts', help='File of the posts.')
+        parser.add_argument('--follows', help='File of the subscriptions.')
+        parser.add_argument('--format', choices=['ndjson', 'csv'],
+                            help='Format of the files, by default taken from the file extension.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of rows written per query.')
+
+    def handle(self, *args, **options):
+        kinds = [kind for kind in ('users', 'posts', 'follows') if options[kind]]
+        if not kinds:
+            raise CommandError('Pass at least one of --users, --posts and --follows.')
+        tables = {}
+        for kind in kinds:
+            def progress(count, elapsed, kind=kind):
+                self.stdout.write(f'{kind}: {count} rows, {count / max(elapsed, 1e-6):.0f} rows/s')
+
+            records = read_records(options[kind], options['format'])
+            try:
+                count, skipped, tables[kind] = import_records(kind, records, options['batch_size'], progress)
+            except (KeyError, ValueError) as e:
+                raise CommandError(f'{options[kind]}: invalid record, {e.__class__.__name__}: {e}')
+            self.stdout.write(self.style.SUCCESS(f'Imported {count} {kind}.'))
+            if skipped:
+                self.stdout.write(self.style.WARNING(f'Skipped {skipped} duplicate {kind}.'))
+        if 'posts' in tables or 'follows' in tables:
+            import_finish(tables.get('posts'), tables.get('follows'))
+            self.stdout.write(self.style.SUCCESS('Updated the counters and the feeds.'))
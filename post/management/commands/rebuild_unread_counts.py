@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from post.models import UserFeed
+from post.utils import feed_rebuild_unread_count
+
+
+class Command(BaseCommand):
+    """
+    Recounts the 'unread_count' of the feeds from the "feed" and "read" fields
+    and fixes the counters that drifted. With --check only reports them.
+    """
+    help = "Recounts the feeds' unread counters from the 'feed' and 'read' fields."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report the wrong counters, do not fix them.')
+
+    def handle(self, *args, **options):
+        total = wrong = 0
+        for obj in UserFeed.objects.all().iterator():
+            stored, count = feed_rebuild_unread_count(obj, save=not options['check'])
+            total += 1
+            if stored != count:
+                wrong += 1
+                self.stdout.write(f'{obj}: unread_count {stored}, actual {count}')
+        action = 'found' if options['check'] else 'fixed'
+        style = self.style.WARNING if wrong and options['check'] else self.style.SUCCESS
+        self.stdout.write(style(f'Checked {total} feeds, {action} {wrong} wrong counters.'))
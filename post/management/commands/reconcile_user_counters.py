@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from post.utils import USER_COUNTERS, user_counters_drift, user_counters_reconcile
+
+
+class Command(BaseCommand):
+    """
+    Recounts 'posts_count', 'followers_count' and 'following_count' of the users
+    from their posts and subscriptions and fixes the counters that drifted. With --check only reports them.
+    """
+    help = "Recounts the users' post, follower and subscription counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report the wrong counters, do not fix them.')
+
+    def handle(self, *args, **options):
+        wrong = []
+        for user in user_counters_drift().only('id', 'email', *USER_COUNTERS).iterator():
+            wrong.append(user.pk)
+            for field in USER_COUNTERS:
+                stored, actual = getattr(user, field), getattr(user, f'actual_{field}')
+                if stored != actual:
+                    self.stdout.write(f'{user}: {field} {stored}, actual {actual}')
+        if wrong and not options['check']:
+            user_counters_reconcile(wrong)
+        action = 'found' if options['check'] else 'fixed'
+        style = self.style.WARNING if wrong and options['check'] else self.style.SUCCESS
+        self.stdout.write(style(f'{action.capitalize()} {len(wrong)} users with wrong counters.'))
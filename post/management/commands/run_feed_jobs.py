@@ -0,0 +1,37 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from post.jobs import run_next_job
+
+
+class Command(BaseCommand):
+    """
+    Background worker of the feed jobs, for example the removal of posts
+    from the feed after unsubscribing. Several workers can run at once.
+    """
+    help = 'Processes the background feed jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty instead of waiting for new jobs.')
+        parser.add_argument('--sleep', type=float, default=5,
+                            help='Seconds to wait when the queue is empty. Default 5.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Posts removed per transaction. Default FEED_PURGE_BATCH_SIZE.')
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        while True:
+            job = run_next_job(options['batch_size'])
+            if job is None:
+                if options['once']:
+                    break
+                sleep(options['sleep'])
+                continue
+            if job.error:
+                failed += 1
+                self.stderr.write(f'Job {job.pk} ({job.action}) failed: {job.error}')
+            else:
+                done += 1
+        self.stdout.write(self.style.SUCCESS(f'Done {done} jobs, {failed} failed.'))
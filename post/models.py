@@ -1,31 +1,199 @@
-from django.db import models
+from collections import Counter
+
+from django.db import IntegrityError, models, transaction
 from rest_framework.exceptions import ValidationError
 
 from blogAPI import settings
+from post.fields import CompressedTextField
+
+
+def update_user_counter(field, counts):
+    """
+    Adds the changes to the counter 'field' of the users ('posts_count', 'followers_count', 'following_count').
+    'counts' maps the user id to the change, users with the same change are updated by one query.
+    """
+    users = {}
+    for user_id, count in counts.items():
+        if count:
+            users.setdefault(count, []).append(user_id)
+    user_model = Post._meta.get_field('owner').related_model
+    for count, user_ids in users.items():
+        user_model.objects.filter(pk__in=user_ids).update(**{field: models.F(field) + count})
+
+
+def update_feed_versions(owners, pulled=False):
+    """
+    Invalidates the cached pages of the feeds showing edited or deleted posts: the versions of the feeds
+    of the owners' followers are incremented, 'pulled' - not pushed posts were changed too,
+    the pages of all feeds are invalidated (their owners may have too many followers to update).
+    """
+    if owners:
+        UserFeed.objects.filter(user__following__following_user__in=owners).update(version=models.F('version') + 1)
+    if pulled:
+        FeedCacheState.add(pulled=1)
+
+
+class PostQuerySet(models.QuerySet):
+    """
+    Keeps the owners' 'posts_count' up to date on bulk creation and deletion of posts,
+    deletion invalidates the cached pages of the feeds showing the posts.
+    Updating 'date_create' updates the dates of the rows of the feeds (FeedPost).
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            update_user_counter('posts_count', Counter(obj.owner_id for obj in objs))
+        return objs
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            rows = list(self.order_by().values_list('owner', 'fan_out').annotate(count=models.Count('id')))
+            counts = Counter()
+            for owner_id, fan_out, count in rows:
+                counts[owner_id] -= count
+            deleted = super().delete()
+            update_user_counter('posts_count', counts)
+            update_feed_versions({owner_id for owner_id, fan_out, count in rows if fan_out},
+                                 pulled=any(not fan_out for owner_id, fan_out, count in rows))
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def update(self, **kwargs):
+        if 'date_create' not in kwargs:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            ids = list(self.values_list('id', flat=True))
+            rows = super().update(**kwargs)
+            dates = Post.objects.filter(pk=models.OuterRef('post_id')).values('date_create')
+            FeedPost.objects.filter(post_id__in=ids).update(date_create=models.Subquery(dates))
+        return rows
+
+    update.alters_data = True
+
+    def delete_archived(self):
+        """
+        Deletes the posts moved to the archive, they are still counted by 'posts_count'.
+        """
+        return super().delete()
+
+    delete_archived.alters_data = True
+    delete_archived.queryset_only = True
 
 
 class Post(models.Model):
     """
     User post model.
+    'fan_out' is False for posts that were not pushed to the followers' feeds
+    (their owner had too many followers), such posts are merged into the feed when it is read.
+    Creating and deleting posts updates the 'posts_count' of the owner in the same transaction,
+    editing updates his 'posts_edits'. Editing and deleting also increment the versions of the followers' feeds.
+    Long texts are stored compressed (see CompressedTextField).
     """
     title = models.CharField(max_length=255)
-    text = models.TextField()
+    text = CompressedTextField()
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         related_name='posts')
     date_create = models.DateTimeField(auto_now_add=True)
+    fan_out = models.BooleanField(default=True)
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            if self._state.adding:
+                super().save(*args, **kwargs)
+                update_user_counter('posts_count', {self.owner_id: 1})
+                return
+            super().save(*args, **kwargs)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None or 'date_create' in update_fields:
+                FeedPost.objects.filter(post_id=self.pk).update(date_create=self.date_create)
+            update_user_counter('posts_edits', {self.owner_id: 1})
+            update_feed_versions({self.owner_id} if self.fan_out else set(), pulled=not self.fan_out)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            deleted = super().delete(*args, **kwargs)
+            update_user_counter('posts_count', {self.owner_id: -1})
+            update_feed_versions({self.owner_id} if self.fan_out else set(), pulled=not self.fan_out)
+        return deleted
+
     class Meta:
         ordering = ['-date_create']
+        indexes = [
+            models.Index(fields=['date_create', 'id'], name='post_date_id_idx'),
+            models.Index(fields=['owner', '-date_create', '-id'], name='post_owner_date_id_idx'),
+            models.Index(fields=['owner', 'date_create'], condition=models.Q(fan_out=False),
+                         name='post_pull_idx'),
+        ]
+
+
+class ArchivedPost(models.Model):
+    """
+    Post moved to the archive by the 'archive_posts' command, it keeps the id of the post.
+    The archived posts are older than POST_ARCHIVE_AGE and are listed after the posts of the post table.
+    The rows of the "feed" and "read" fields of the feeds are moved with the post
+    (see ArchivedFeedPost and ArchivedReadPost), so the post stays read or unread in every feed.
+    """
+    title = models.CharField(max_length=255)
+    text = CompressedTextField()
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_posts')
+    date_create = models.DateTimeField()
+    fan_out = models.BooleanField(default=True)
+
+    def __str__(self):
+        return self.title
+
+    class Meta:
+        ordering = ['-date_create']
+        indexes = [
+            models.Index(fields=['date_create', 'id'], name='archive_date_id_idx'),
+            models.Index(fields=['owner', '-date_create', '-id'], name='archive_owner_date_id_idx'),
+        ]
+
+
+class UserFollowingQuerySet(models.QuerySet):
+    """
+    Keeps the users' 'followers_count' and 'following_count' up to date
+    on bulk creation and deletion of subscriptions.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            update_user_counter('followers_count', Counter(obj.following_user_id for obj in objs))
+            update_user_counter('following_count', Counter(obj.user_id for obj in objs))
+        return objs
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            follows = list(self.values_list('user', 'following_user'))
+            deleted = super().delete()
+            update_user_counter('followers_count', {k: -v for k, v in Counter(f[1] for f in follows).items()})
+            update_user_counter('following_count', {k: -v for k, v in Counter(f[0] for f in follows).items()})
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
 
 
 class UserFollowing(models.Model):
     """
     User subscription model. Does not allow you to follow yourself or follow the same user twice.
+    Creating and deleting subscriptions updates 'followers_count' and 'following_count' of the users
+    in the same transaction. (Subscriptions deleted together with a user are not counted,
+    run 'reconcile_user_counters' after deleting users.)
     """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="following", on_delete=models.CASCADE)
     following_user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="followers", on_delete=models.CASCADE)
@@ -42,9 +210,23 @@ class UserFollowing(models.Model):
         if self.user == self.following_user:
             raise ValidationError({'error': "Users can't follow themselves"})
 
+    objects = UserFollowingQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         self.full_clean(validate_unique=False)
-        super().save(*args, **kwargs)
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            update_user_counter('followers_count', {self.following_user_id: 1})
+            update_user_counter('following_count', {self.user_id: 1})
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            deleted = super().delete(*args, **kwargs)
+            update_user_counter('followers_count', {self.following_user_id: -1})
+            update_user_counter('following_count', {self.user_id: -1})
+        return deleted
 
     def __str__(self):
         return f'{self.user} follows {self.following_user}'
@@ -53,14 +235,143 @@ class UserFollowing(models.Model):
 class UserFeed(models.Model):
     """
     User's post feed model.
-    User posts are added to the 'feed' field after subscribing to them.
-    (Posts created before the moment of subscription will not be added.)
-    The 'read' field contains the id of posts that have been read.
+    New posts of followed users are added to the 'feed' field when they are created,
+    except posts with 'fan_out' = False, which are merged into the feed when it is read.
+    (Posts created before the moment of subscription will not be added,
+    except the latest FEED_FOLLOW_BACKFILL posts, which are added when subscribing.)
+    All posts of the feed created before or at 'read_until' have been read.
+    The 'read' field contains the id of posts created after 'read_until' that have been read.
+    'unread_count' is the number of unread posts in the 'feed' field and in its archived rows (ArchivedFeedPost),
+    it is updated together with the feed.
+    'version' is incremented on every change of the feed or of its read posts, it is part of the keys
+    of the cached feed pages.
+    The rows of the 'feed' field (FeedPost) carry the dates of their posts.
     """
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True)
-    feed = models.ManyToManyField(Post, blank=True)
+    feed = models.ManyToManyField(Post, through='FeedPost', blank=True)
     date_update = models.DateTimeField(auto_now=True)
     read = models.ManyToManyField(Post, blank=True, related_name='readers')
+    read_until = models.DateTimeField(null=True, blank=True)
+    unread_count = models.IntegerField(default=0)
+    version = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f'{self.user} post feed'
+
+
+class FeedPostQuerySet(models.QuerySet):
+    """
+    Copies the dates of the posts to the rows created without them (the add() and create() of the "feed" field).
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        missing = [obj for obj in objs if obj.date_create is None]
+        if missing:
+            dates = dict(Post.objects.filter(pk__in={obj.post_id for obj in missing}).values_list('id', 'date_create'))
+            for obj in missing:
+                obj.date_create = dates[obj.post_id]
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class FeedPost(models.Model):
+    """
+    Post of the "feed" field of a feed. 'date_create' is a copy of the date of the post,
+    so the pages of the feed are read from the index of the feed in the order of the posts.
+    """
+    userfeed = models.ForeignKey(UserFeed, on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    date_create = models.DateTimeField()
+
+    objects = FeedPostQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['userfeed', 'post'], name='unique_feed_post')
+        ]
+        indexes = [
+            models.Index(fields=['userfeed', '-date_create', '-post'], name='feed_post_date_idx'),
+        ]
+
+
+class ArchivedFeedPost(models.Model):
+    """
+    Archived post of the "feed" field of a feed, the row is moved from the field with the post.
+    """
+    userfeed = models.ForeignKey(UserFeed, on_delete=models.CASCADE)
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['userfeed', 'post'], name='unique_archived_feed_post')
+        ]
+
+
+class ArchivedReadPost(models.Model):
+    """
+    Archived post of the "read" field of a feed, the row is moved from the field with the post.
+    """
+    userfeed = models.ForeignKey(UserFeed, on_delete=models.CASCADE)
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['userfeed', 'post'], name='unique_archived_read_post')
+        ]
+
+
+class FeedJob(models.Model):
+    """
+    Background feed job, processed by the 'run_feed_jobs' command.
+    'purge' removes the posts of 'author' from the feed of 'user' after unsubscribing.
+    A job is locked by the worker that runs it until 'locked_until'; failed jobs are retried
+    until 'attempts' reaches FEED_JOB_MAX_ATTEMPTS.
+    """
+    PURGE = 'purge'
+    ACTIONS = [
+        (PURGE, 'Purge unfollowed posts'),
+    ]
+
+    action = models.CharField(max_length=16, choices=ACTIONS)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['created']
+
+    def __str__(self):
+        return f'{self.action} {self.author} from {self.user} feed'
+
+
+class FeedCacheState(models.Model):
+    """
+    Shared state of the feed page cache, a single row seen by all server processes.
+    'pulled' is incremented when not pushed posts ('fan_out' = False) are created or deleted,
+    it is part of the keys of the cached feed pages. 'hits' and 'misses' count the reads of the cache.
+    """
+    ROW_ID = 1
+
+    pulled = models.BigIntegerField(default=0)
+    hits = models.BigIntegerField(default=0)
+    misses = models.BigIntegerField(default=0)
+
+    @classmethod
+    def add(cls, **values):
+        """
+        Adds the values to the counters, the row is created by the first call.
+        """
+        changes = {name: models.F(name) + value for name, value in values.items()}
+        if cls.objects.filter(pk=cls.ROW_ID).update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(pk=cls.ROW_ID, **values)
+        except IntegrityError:
+            cls.objects.filter(pk=cls.ROW_ID).update(**changes)
+
+    def __str__(self):
+        return 'Feed cache state'
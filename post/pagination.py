@@ -0,0 +1,205 @@
+from django.core.exceptions import ValidationError
+from django.utils.functional import cached_property
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+from post.models import ArchivedPost
+
+ARCHIVE_MARK = '|archive'
+
+
+class PostsCursorPagination(CursorPagination):
+    """
+    Cursor pagination keyed on ('date_create', 'id'). The default is 10 posts per page.
+    You can change the number of posts by passing the 'page_size' parameter.
+    Max value = 100 posts per page.
+    The page is selected by a range condition on the key, so no count query is made
+    and deep pages are as fast as the first one: the posts are read in the order of their index
+    (the feed is paged by FeedCursorPagination).
+    New posts at the head of the list do not shift the following pages.
+    If the view has get_archive_queryset(), the archived posts follow the posts of the queryset,
+    the archive is queried only by the pages reaching past the end of the queryset.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-date_create', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        # The archived posts are older than the posts of the queryset, they are read
+        # only when the page reaches past the end of the queryset.
+        archive = view.get_archive_queryset() if hasattr(view, 'get_archive_queryset') else None
+        archived = current_position is not None and current_position.endswith(ARCHIVE_MARK)
+        if archived:
+            current_position = current_position[:-len(ARCHIVE_MARK)]
+        if archive is None:
+            sources = [queryset]
+        elif reverse:
+            sources = [archive, queryset] if archived else [queryset]
+        else:
+            sources = [archive] if archived else [queryset, archive]
+
+        results, skip = [], offset
+        for source in sources:
+            results += self.get_page(source, current_position, reverse, skip, self.page_size + 1 - len(results))
+            skip = 0
+            if len(results) > self.page_size:
+                break
+        if archived:
+            current_position += ARCHIVE_MARK
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_page(self, source, position, reverse, offset, limit, ordering=None):
+        """
+        Returns 'limit' items of the source following the position, after skipping 'offset' of them.
+        'ordering' is the ordering of the source when its fields are named differently (the same direction).
+        """
+        ordering = ordering or self.ordering
+        if reverse:
+            source = source.order_by(*[self._reverse(order) for order in ordering])
+        else:
+            source = source.order_by(*ordering)
+
+        if position is not None:
+            try:
+                source = source.filter(self._get_position_filter(position, reverse, ordering))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        return list(source[offset:offset + limit])
+
+    def _get_position_filter(self, position, reverse, ordering=None):
+        """
+        Returns the keyset condition for the items following the position:
+        (a < a0) OR (a = a0 AND b < b0) for the ordering ('-a', '-b').
+        """
+        ordering = ordering or self.ordering
+        values = position.split('|')
+        if len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        condition = Q()
+        equal = {}
+        for order, value in zip(ordering, values):
+            attr = order.lstrip('-')
+            lookup = 'lt' if order.startswith('-') != reverse else 'gt'
+            condition |= Q(**equal, **{f'{attr}__{lookup}': value})
+            equal[attr] = value
+        return condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            field_name = order.lstrip('-')
+            if isinstance(instance, dict):
+                attr = instance[field_name]
+            else:
+                attr = getattr(instance, field_name)
+            values.append(str(attr))
+        # The positions of the archived posts are marked, their pages skip the queryset.
+        archived = instance.get('archived') if isinstance(instance, dict) else isinstance(instance, ArchivedPost)
+        return '|'.join(values) + (ARCHIVE_MARK if archived else '')
+
+    @staticmethod
+    def _reverse(order):
+        return order[1:] if order.startswith('-') else '-' + order
+
+
+class FeedCursorPagination(PostsCursorPagination):
+    """
+    Cursor pagination of the feed. When the view's get_feed_keys() returns the keys of the feed (see feed_keys)
+    and the posts to read, a page is the merge of the pages of the keys of the pushed and of the not pushed posts,
+    and only the posts of the page are read. The pushed keys are read from the index of the feed
+    (FeedPost.date_create), so the feed is not sorted and deep pages cost the same as the first one.
+    The archived posts and the searched feed are paged as the other querysets.
+    """
+    keys_ordering = [('-date_create', '-post_id'), ('-date_create', '-id')]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.queryset = queryset
+        self.keys = view.get_feed_keys() if hasattr(view, 'get_feed_keys') else None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_page(self, source, position, reverse, offset, limit, ordering=None):
+        if source is not self.queryset or self.keys is None:
+            return super().get_page(source, position, reverse, offset, limit, ordering)
+        *keys, posts = self.keys
+        found = set()
+        for rows, ordering in zip(keys, self.keys_ordering):
+            found.update(super().get_page(rows, position, reverse, 0, offset + limit, ordering))
+        ids = [pk for date, pk in sorted(found, reverse=not reverse)[offset:offset + limit]]
+        posts = {post['id']: post for post in posts.filter(id__in=ids).order_by()}
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+class SearchCursorPagination(PostsCursorPagination):
+    """
+    Cursor pagination of the search results keyed on ('rank', 'id'), the most relevant posts first.
+    """
+    ordering = ('-rank', '-id')
+
+
+class ArchiveChain:
+    """
+    The posts of the queryset followed by the archived posts, counted and sliced like a single queryset
+    by the page number pagination. The archive is read only by the pages reaching past the end of the queryset.
+    """
+    ordered = True
+
+    def __init__(self, queryset, archive):
+        self.queryset = queryset
+        self.archive = archive
+
+    @cached_property
+    def queryset_count(self):
+        return self.queryset.count()
+
+    def count(self):
+        return self.queryset_count + self.archive.count()
+
+    def __getitem__(self, key):
+        start, stop = key.start or 0, key.stop
+        items = list(self.queryset[start:stop]) if start < self.queryset_count else []
+        if stop > self.queryset_count:
+            items += list(self.archive[max(start - self.queryset_count, 0):stop - self.queryset_count])
+        return items
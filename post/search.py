@@ -0,0 +1,92 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from post.fields import DECOMPRESS_FUNCTION
+
+# Postgres: GIN index over the text vector of the post, the queries use the same expression.
+PG_VECTOR = "to_tsvector('english', coalesce({table}title, '') || ' ' || coalesce({table}text, ''))"
+PG_QUERY = "websearch_to_tsquery('english', %s)"
+PG_INDEX = 'post_search_idx'
+
+# SQLite: FTS5 table with the content of the post table, kept up to date by triggers.
+# The texts may be compressed, the triggers index their decompressed text.
+FTS_TABLE = 'post_post_fts'
+FTS_SQL = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(title, text, content='post_post', content_rowid='id')",
+    f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON post_post BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, text) VALUES (new.id, new.title, {DECOMPRESS_FUNCTION}(new.text)); END",
+    f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON post_post BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, text) "
+    f"VALUES ('delete', old.id, old.title, {DECOMPRESS_FUNCTION}(old.text)); END",
+    f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF title, text ON post_post BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, text) "
+    f"VALUES ('delete', old.id, old.title, {DECOMPRESS_FUNCTION}(old.text)); "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, text) VALUES (new.id, new.title, {DECOMPRESS_FUNCTION}(new.text)); END",
+    f"INSERT INTO {FTS_TABLE}(rowid, title, text) SELECT id, title, {DECOMPRESS_FUNCTION}(text) FROM post_post",
+]
+
+
+def setup_search(using='default', **kwargs):
+    """
+    Creates the search index of the posts if it does not exist, the existing posts are indexed.
+    Connected to the 'post_migrate' signal.
+    """
+    connection = connections[using]
+    if 'post_post' not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON post_post "
+                           f"USING GIN ({PG_VECTOR.format(table='')})")
+        elif connection.vendor == 'sqlite' and FTS_TABLE not in connection.introspection.table_names():
+            for sql in FTS_SQL:
+                cursor.execute(sql)
+
+
+def fts_query(query):
+    """
+    Turns the user's query into an FTS5 query: all the words must match, prefixes of the last word too.
+    The words are quoted, so the FTS5 syntax characters of the query are not interpreted.
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+def search_posts(queryset, query, rank=True):
+    """
+    Filters the posts matching the search query using the search index of the database.
+    With 'rank' the posts are annotated with the relevance 'rank', the higher the better.
+    Other databases fall back to a case-insensitive substring search with 'rank' = 0.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        vector = PG_VECTOR.format(table='"post_post".')
+        queryset = queryset.filter(RawSQL(f'{vector} @@ {PG_QUERY}', (query,), output_field=BooleanField()))
+        if rank:
+            # ts_rank returns real, the cast makes the rank equal to the Python float stored in the cursor,
+            # otherwise the pages of posts with tied ranks repeat or skip posts.
+            queryset = queryset.annotate(rank=RawSQL(f'ts_rank({vector}, {PG_QUERY})::double precision', (query,),
+                                                     output_field=FloatField()))
+        return queryset
+    if vendor == 'sqlite':
+        match = fts_query(query)
+        if match is None:
+            queryset = queryset.none()
+            return queryset.annotate(rank=Value(0.0, output_field=FloatField())) if rank else queryset
+        if not rank:
+            return queryset.filter(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+                                                 (match,)))
+        # The rank is read from the joined FTS table, it is computed once per matching post.
+        queryset = queryset.extra(tables=[FTS_TABLE],
+                                  where=[f'{FTS_TABLE}.rowid = "post_post"."id"', f'{FTS_TABLE} MATCH %s'],
+                                  params=[match])
+        return queryset.annotate(rank=RawSQL(f'-{FTS_TABLE}.rank', (), output_field=FloatField()))
+    queryset = queryset.filter(Q(title__icontains=query) | Q(text__icontains=query))
+    if rank:
+        queryset = queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+    return queryset
@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
+from rest_framework.utils.serializer_helpers import ReturnList
 
 from post.models import Post, UserFollowing
 
@@ -8,14 +10,17 @@ UserModel = get_user_model()
 
 class UserListSerializer(serializers.ModelSerializer):
     """
-    Displays information about the user, and also shows the number of his posts.
+    Displays information about the user, and also shows the number of his posts,
+    followers and subscriptions.
     """
     posts_count = serializers.IntegerField(read_only=True)
+    followers_count = serializers.IntegerField(read_only=True)
+    following_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = UserModel
         fields = (
-            'id', 'email', 'posts_count',
+            'id', 'email', 'posts_count', 'followers_count', 'following_count',
         )
 
 
@@ -29,15 +34,41 @@ class PostOwnerSerializer(serializers.ModelSerializer):
         fields = ('id', 'email')
 
 
+class PostListSerializer(serializers.ListSerializer):
+    """
+    Creates many posts with one bulk insert. At most POST_BULK_CREATE_MAX posts are accepted.
+    """
+
+    def validate(self, attrs):
+        if len(attrs) > settings.POST_BULK_CREATE_MAX:
+            raise serializers.ValidationError(
+                {'error': f'Ensure this list has no more than {settings.POST_BULK_CREATE_MAX} posts'})
+        return attrs
+
+    def create(self, validated_data):
+        return Post.objects.bulk_create([Post(**item) for item in validated_data])
+
+
 class PostSerializer(serializers.ModelSerializer):
     """
     Displays information about the post and its owner.
+    Pass 'fields' to display only these fields,
+    and 'excerpt' to display the 'text_excerpt' attribute of the post as the text.
     """
     owner = PostOwnerSerializer(read_only=True)
 
     class Meta:
         model = Post
         fields = ('id', 'title', 'text', 'owner', 'date_create',)
+        list_serializer_class = PostListSerializer
+
+    def __init__(self, *args, fields=None, excerpt=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        if excerpt and 'text' in self.fields:
+            self.fields['text'] = serializers.CharField(source='text_excerpt', read_only=True)
 
 
 class FollowingSerializer(serializers.ModelSerializer):
@@ -52,3 +83,88 @@ class FollowingSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'following_user': {'write_only': True},
         }
+
+
+class FeedReadSerializer(serializers.Serializer):
+    """
+    Marks posts of the feed as read: either the posts with the given "ids",
+    or all posts created before or at "until".
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False,
+                                allow_empty=False, max_length=100)
+    until = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('until' in attrs):
+            raise serializers.ValidationError({'error': 'Pass either "ids" or "until"'})
+        return attrs
+
+
+class FeedUnreadSerializer(serializers.Serializer):
+    """
+    Displays the number of unread posts in the feed.
+    """
+    unread_count = serializers.IntegerField(read_only=True)
+
+
+class PostValuesSerializer:
+    """
+    Read-only fast path of PostSerializer for the lists.
+    The field plan is compiled once from the fields of the serializer, the posts are fetched
+    as values() rows with the owner columns joined and turned into dicts by the plan,
+    no model instances or serializer fields are created per post. The output is the same as the serializer's,
+    the data is a ReturnList of the serializer the plan was compiled from.
+    """
+    # The fields whose representation of the database value is the value itself.
+    plain_fields = (serializers.CharField, serializers.IntegerField)
+
+    def __init__(self, plan, instance=None, serializer=None):
+        self.plan = plan
+        self.instance = instance
+        self.serializer = serializer
+
+    @classmethod
+    def compile(cls, serializer, prefix=''):
+        """
+        Returns the plan of the serializer: (name, column, convert) for the fields
+        and (name, None, plan) for the nested serializers.
+        """
+        plan = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            column = prefix + '__'.join(field.source_attrs)
+            if isinstance(field, serializers.BaseSerializer):
+                plan.append((name, None, cls.compile(field, column + '__')))
+            elif type(field) in cls.plain_fields:
+                plan.append((name, column, None))
+            else:
+                plan.append((name, column, field.to_representation))
+        return plan
+
+    @property
+    def columns(self):
+        """
+        The columns of the rows to pass to values().
+        """
+        def columns(plan):
+            for name, column, convert in plan:
+                if column is None:
+                    yield from columns(convert)
+                else:
+                    yield column
+        return list(columns(self.plan))
+
+    def to_representation(self, row, plan=None):
+        data = {}
+        for name, column, convert in plan or self.plan:
+            if column is None:
+                data[name] = self.to_representation(row, convert)
+            else:
+                value = row[column]
+                data[name] = convert(value) if convert is not None and value is not None else value
+        return data
+
+    @property
+    def data(self):
+        return ReturnList([self.to_representation(row) for row in self.instance], serializer=self.serializer)
@@ -1,15 +1,27 @@
 import json
+from datetime import timedelta
 from time import sleep
 
 from django.contrib.auth import get_user_model
-from django.db.models import Count
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
 
-from post.models import Post, UserFollowing, UserFeed
-from post.serializer import UserListSerializer
+from post.cache import feed_cache_stats, pending
+from post.fields import COMPRESSED_PREFIX
+from post.jobs import run_next_job
+from post.models import Post, UserFollowing, UserFeed, FeedJob, FeedPost, ArchivedPost, FeedCacheState
+from post.serializer import UserListSerializer, FollowingSerializer, PostSerializer
+from post.utils import feed_fan_out, feed_posts, feed_unread_posts, feed_mark_read, feed_refresh, posts_archive, \
+    feed_rebuild_unread_count, feed_mark_read_until, feed_read_posts
 
 UserModel = get_user_model()
 
@@ -53,6 +65,94 @@ class PostCreateAPIViewAPITestCase(APITestCase):
         self.assertEqual(1, Post.objects.count())
         self.assertEqual('john.doe@example.com', Post.objects.last().owner.email)
 
+    def test_create_fan_out(self):
+        UserFollowing.objects.create(user=self.user2, following_user=self.user)
+        UserFeed.objects.create(user=self.user2)
+        url = reverse('post_create')
+        data = {
+            'title': 'Test post title',
+            'text': 'Test post text',
+        }
+        json_data = json.dumps(data)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(url, data=json_data,
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual([response.data['id']],
+                         list(UserFeed.objects.get(pk=self.user2.pk).feed.values_list('id', flat=True)))
+
+    def test_create_fan_out_not_follower(self):
+        UserFeed.objects.create(user=self.user2)
+        url = reverse('post_create')
+        data = {
+            'title': 'Test post title',
+            'text': 'Test post text',
+        }
+        json_data = json.dumps(data)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(url, data=json_data,
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(0, UserFeed.objects.get(pk=self.user2.pk).feed.count())
+
+
+class PostBulkCreateAPIViewAPITestCase(APITestCase):
+    def setUp(self):
+        self.email = 'john.doe@example.com'
+        self.password = '123456super'
+        self.user = UserModel.objects.create_user(self.email, self.password)
+
+        self.email2 = 'jane.doe@example.com'
+        self.password2 = '123456super'
+        self.user2 = UserModel.objects.create_user(self.email2, self.password2)
+
+    def test_bulk_create(self):
+        UserFollowing.objects.create(user=self.user2, following_user=self.user)
+        UserFeed.objects.create(user=self.user2)
+        url = reverse('post_bulk_create')
+        data = [{'title': f'Test post title_{i}', 'text': f'Test post text_{i}'} for i in range(5)]
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(10):
+            response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual([f'Test post title_{i}' for i in range(5)], [k['title'] for k in response.data])
+        self.assertEqual(5, Post.objects.filter(owner=self.user, id__in=[k['id'] for k in response.data]).count())
+        self.assertEqual(self.email, response.data[0]['owner']['email'])
+        obj = UserFeed.objects.get(pk=self.user2.pk)
+        self.assertEqual(5, obj.feed.count())
+        self.assertEqual(5, obj.unread_count)
+        self.assertEqual(5, UserModel.objects.get(pk=self.user.pk).posts_count)
+
+    def test_bulk_create_invalid(self):
+        url = reverse('post_bulk_create')
+        data = [{'title': 'Test post title', 'text': 'Test post text'}, {'title': 'Test post title'}]
+        self.client.force_authenticate(self.user)
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({}, response.data[0])
+        self.assertIn('text', response.data[1])
+        self.assertEqual(0, Post.objects.count())
+
+    @override_settings(POST_BULK_CREATE_MAX=2)
+    def test_bulk_create_limit(self):
+        url = reverse('post_bulk_create')
+        self.client.force_authenticate(self.user)
+        data = [{'title': 'Test post title', 'text': 'Test post text'}] * 3
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = self.client.post(url, data=json.dumps([]), content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = self.client.post(url, data=json.dumps({'title': 'Test', 'text': 'Test'}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual(0, Post.objects.count())
+
+    def test_bulk_create_noauth(self):
+        url = reverse('post_bulk_create')
+        response = self.client.post(url, data=json.dumps([{'title': 'Test', 'text': 'Test'}]),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+
 
 class PostListAPIViewAPITestCase(APITestCase):
     def setUp(self):
@@ -82,13 +182,251 @@ class PostListAPIViewAPITestCase(APITestCase):
         url = reverse('user_posts', args=(self.user.pk,))
         response = self.client.get(url)
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(5, len(response.data))
+        self.assertEqual(5, len(response.data['results']))
 
     def test_posts_list2(self):
         url = reverse('user_posts', args=(self.user2.pk,))
         response = self.client.get(url)
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(2, len(response.data))
+        self.assertEqual(2, len(response.data['results']))
+
+    def test_posts_list_empty(self):
+        user3 = UserModel.objects.create_user('jax.doe@example.com', '123456super')
+        response = self.client.get(reverse('user_posts', args=(user3.pk,)))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([], response.data['results'])
+
+    def test_posts_list_pagination(self):
+        posts = list(Post.objects.filter(owner=self.user).order_by('-date_create', '-id'))
+        url = reverse('user_posts', args=(self.user.pk,))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'page_size': 3})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(2, len(queries))
+        self.assertFalse(any(q['sql'].startswith('SELECT (1)') for q in queries.captured_queries))
+        self.assertEqual([k.id for k in posts[:3]], [k['id'] for k in response.data['results']])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([k.id for k in posts[3:]], [k['id'] for k in response.data['results']])
+        self.assertIsNone(response.data['next'])
+
+    def test_posts_list_etag(self):
+        url = reverse('user_posts', args=(self.user.pk,))
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        self.assertEqual(b'', response.content)
+        Post.objects.create(title='Test post title', text='Test post text', owner=self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        response = self.client.get(reverse('user_posts', args=(self.user2.pk,)), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_posts_list_etag_edit(self):
+        url = reverse('user_posts', args=(self.user.pk,))
+        etag = self.client.get(url)['ETag']
+        post = Post.objects.filter(owner=self.user).first()
+        serializer = PostSerializer(post, data={'title': 'Edited title'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        self.assertEqual('Edited title', response.data['results'][0]['title'])
+
+    @override_settings(POST_ARCHIVE_AGE=timedelta(days=30))
+    def test_posts_list_archive(self):
+        old = Post.objects.filter(owner=self.user).order_by('id')[:3]
+        Post.objects.filter(pk__in=[post.pk for post in old]).update(date_create=timezone.now() - timedelta(days=40))
+        posts = list(Post.objects.filter(owner=self.user).order_by('-date_create', '-id').values_list('id', flat=True))
+        posts_archive(timezone.now() - timedelta(days=30))
+        self.assertEqual(2, Post.objects.filter(owner=self.user).count())
+        url = reverse('user_posts', args=(self.user.pk,))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'page_size': 1})
+        self.assertFalse([q for q in queries.captured_queries if 'archive' in q['sql']])
+        results = [k['id'] for k in response.data['results']]
+        pages = [response.data]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).data)
+            results += [k['id'] for k in pages[-1]['results']]
+        self.assertEqual(posts, results)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(pages[-2]['next'])
+        # The list queries, not the ETag version query.
+        lists = [q['sql'] for q in queries.captured_queries if 'ORDER BY' in q['sql'] and 'posts_count' not in q['sql']]
+        self.assertEqual(1, len(lists))
+        self.assertIn('post_archivedpost', lists[0])
+        response = self.client.get(pages[-1]['previous'])
+        self.assertEqual([posts[-2]], [k['id'] for k in response.data['results']])
+        response = self.client.get(pages[2]['previous'])
+        self.assertEqual([posts[1]], [k['id'] for k in response.data['results']])
+        response = self.client.get(reverse('user_posts_export', args=(self.user.pk,)))
+        self.assertEqual(posts, [json.loads(line)['id'] for line in b''.join(response.streaming_content).splitlines()])
+
+    def test_posts_list_fields(self):
+        url = reverse('user_posts', args=(self.user.pk,))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'id,title'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(2, len(queries))
+        self.assertNotIn('"text"', queries.captured_queries[-1]['sql'])
+        self.assertEqual({'id', 'title'}, set(response.data['results'][0]))
+        response = self.client.get(url, {'fields': 'owner'})
+        self.assertEqual({'owner'}, set(response.data['results'][0]))
+        self.assertEqual(self.email, response.data['results'][0]['owner']['email'])
+
+    def test_posts_list_excerpt(self):
+        Post.objects.create(title='Test post title', text='x' * 1000, owner=self.user)
+        url = reverse('user_posts', args=(self.user.pk,))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'excerpt': 10})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(2, len(queries))
+        self.assertEqual('x' * 10, response.data['results'][0]['text'])
+        self.assertEqual({'id', 'title', 'text', 'owner', 'date_create'}, set(response.data['results'][0]))
+        response = self.client.get(url, {'excerpt': 10, 'fields': 'title'})
+        self.assertEqual({'title'}, set(response.data['results'][0]))
+
+    def test_posts_list_fields_invalid(self):
+        url = reverse('user_posts', args=(self.user.pk,))
+        for params in ({'fields': 'id,password'}, {'fields': ','}, {'excerpt': 0}, {'excerpt': 'ten'}):
+            response = self.client.get(url, params)
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+            self.assertIn('error', response.data)
+
+
+class PostExportAPIViewAPITestCase(APITestCase):
+    def setUp(self):
+        self.email = 'john.doe@example.com'
+        self.password = '123456super'
+        self.user = UserModel.objects.create_user(self.email, self.password)
+
+        for i in range(5):
+            Post.objects.create(title=f'Test post title_{i}', text=f'Test post text_{i}', owner=self.user)
+
+    @override_settings(POST_EXPORT_CHUNK_SIZE=2)
+    def test_export(self):
+        url = reverse('user_posts_export', args=(self.user.pk,))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            content = b''.join(response.streaming_content)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response.streaming)
+        self.assertEqual('application/x-ndjson', response['Content-Type'])
+        self.assertEqual(2, len(queries))
+        lines = [json.loads(line) for line in content.decode().splitlines()]
+        posts = Post.objects.filter(owner=self.user).order_by('-date_create', '-id')
+        self.assertEqual([post.id for post in posts], [line['id'] for line in lines])
+        self.assertEqual(self.client.get(reverse('user_posts', args=(self.user.pk,))).data['results'][0], lines[0])
+
+    def test_export_fields(self):
+        url = reverse('user_posts_export', args=(self.user.pk,))
+        response = self.client.get(url, {'fields': 'id,text', 'excerpt': 4})
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(5, len(lines))
+        self.assertEqual({'id', 'text'}, set(lines[0]))
+        self.assertEqual('Test', lines[0]['text'])
+
+    def test_export_empty(self):
+        user2 = UserModel.objects.create_user('jane.doe@example.com', '123456super')
+        response = self.client.get(reverse('user_posts_export', args=(user2.pk,)))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(b'', b''.join(response.streaming_content))
+
+    def test_export_user_not_exist(self):
+        response = self.client.get(reverse('user_posts_export', args=(2000,)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        self.assertEqual({'error': ErrorDetail(string='User not found', code='not_found')}, response.data)
+
+
+class PostSearchAPIViewAPITestCase(APITestCase):
+    def setUp(self):
+        self.email = 'john.doe@example.com'
+        self.password = '123456super'
+        self.user = UserModel.objects.create_user(self.email, self.password)
+
+        self.post1 = Post.objects.create(title='Django tips', text='Cursor pagination in Django', owner=self.user)
+        self.post2 = Post.objects.create(title='Gardening', text='Tomatoes and django reinhardt', owner=self.user)
+        self.post3 = Post.objects.create(title='Cooking', text='Pasta with tomatoes', owner=self.user)
+
+    def test_search(self):
+        url = reverse('post_search')
+        response = self.client.get(url, {'q': 'django'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([self.post1.id, self.post2.id], [k['id'] for k in response.data['results']])
+        response = self.client.get(url, {'q': 'tomatoes pasta'})
+        self.assertEqual([self.post3.id], [k['id'] for k in response.data['results']])
+
+    def test_search_fields(self):
+        url = reverse('post_search')
+        response = self.client.get(url, {'q': 'django', 'fields': 'id,text', 'excerpt': 6})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([{'id': self.post1.id, 'text': 'Cursor'}, {'id': self.post2.id, 'text': 'Tomato'}],
+                         response.data['results'])
+
+    @override_settings(POST_TEXT_COMPRESS_SIZE=10)
+    def test_search_compressed(self):
+        text = 'Compressed ' + 'words ' * 100
+        post = Post.objects.create(title='Long post', text=text, owner=self.user)
+        self.assertEqual(1, Post.objects.filter(pk=post.pk, text__startswith=COMPRESSED_PREFIX).count())
+        prefixed = Post.objects.create(title='Short post', text=f'{COMPRESSED_PREFIX}x', owner=self.user)
+        self.assertEqual(f'{COMPRESSED_PREFIX}x', Post.objects.get(pk=prefixed.pk).text)
+        url = reverse('post_search')
+        response = self.client.get(url, {'q': 'compressed words', 'excerpt': 10})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([(post.id, 'Compressed')], [(k['id'], k['text']) for k in response.data['results']])
+        response = self.client.get(url, {'q': 'compressed'})
+        self.assertEqual(text, response.data['results'][0]['text'])
+        post.delete()
+        self.assertEqual([], self.client.get(url, {'q': 'compressed'}).data['results'])
+
+    def test_search_update(self):
+        url = reverse('post_search')
+        self.post3.text = 'Pizza'
+        self.post3.save()
+        self.post2.delete()
+        Post.objects.bulk_create([Post(title='More tomatoes', text='Text', owner=self.user)])
+        response = self.client.get(url, {'q': 'tomatoes'})
+        self.assertEqual(['More tomatoes'], [k['title'] for k in response.data['results']])
+        response = self.client.get(url, {'q': 'pizza'})
+        self.assertEqual([self.post3.id], [k['id'] for k in response.data['results']])
+
+    def test_search_pagination(self):
+        # The posts have tied ranks, the pages are split between them.
+        Post.objects.bulk_create([Post(title=f'Django {i}', text='Text', owner=self.user) for i in range(5)])
+        url = reverse('post_search')
+        response = self.client.get(url, {'q': 'django', 'page_size': 3})
+        ids = [k['id'] for k in response.data['results']]
+        self.assertEqual(3, len(ids))
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [k['id'] for k in response.data['results']]
+        self.assertEqual(7, len(ids))
+        self.assertEqual(7, len(set(ids)))
+
+    def test_search_invalid(self):
+        url = reverse('post_search')
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = self.client.get(url, {'q': '"django" OR -*'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.client.get(url, {'q': '***'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([], response.data['results'])
+
+    def test_search_feed(self):
+        user2 = UserModel.objects.create_user('jane.doe@example.com', '123456super')
+        UserFollowing.objects.create(user=user2, following_user=self.user)
+        obj = UserFeed.objects.create(user=user2)
+        obj.feed.add(self.post1, self.post3)
+        self.client.force_authenticate(user2)
+        response = self.client.get(reverse('posts_feed'), {'q': 'django'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([self.post1.id], [k['id'] for k in response.data['results']])
 
 
 class FollowListCreateAPIViewAPITestCase(APITestCase):
@@ -174,6 +512,24 @@ class FollowListCreateAPIViewAPITestCase(APITestCase):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertEqual(1, len(response.data))
 
+    @override_settings(STREAMING_LIST_THRESHOLD=1)
+    def test_follow_list_streaming(self):
+        url = reverse('follow')
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url)
+        self.assertFalse(response.streaming)
+        self.assertEqual(1, len(response.data))
+
+        UserFollowing.objects.create(user=self.user, following_user=self.user3)
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response.streaming)
+        self.assertEqual('application/json', response['Content-Type'])
+        expected = JSONRenderer().render(FollowingSerializer(UserFollowing.objects.filter(user=self.user),
+                                                             many=True).data)
+        self.assertEqual(expected, b''.join(response.streaming_content))
+
     def test_follow_list_noauth(self):
         url = reverse('follow')
         UserFollowing.objects.create(user=self.user, following_user=self.user2)
@@ -243,9 +599,47 @@ class FollowListCreateAPIViewAPITestCase(APITestCase):
         response = self.client.post(url, data=json_data,
                                     content_type='application/json')
         self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        # Subscribing does not sync the feed, the posts missing from it are added when it is read.
+        self.assertEqual(0, UserFeed.objects.get(pk=self.user.pk).feed.count())
+        with override_settings(FEED_REFRESH_INTERVAL=timedelta(0)):
+            response = self.client.get(reverse('posts_feed'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertEqual(2, UserFeed.objects.get(pk=self.user.pk).feed.count())
         self.assertGreater(UserFeed.objects.get(pk=self.user.pk).date_update, date)
 
+    @override_settings(FEED_FOLLOW_BACKFILL=2)
+    def test_follow_backfill(self):
+        obj = UserFeed.objects.create(user=self.user)
+        posts = [Post.objects.create(title=f'test title_{i}', text='test text', owner=self.user2) for i in range(3)]
+        Post.objects.create(title='test title', text='test text', owner=self.user3)
+        self.client.force_authenticate(self.user)
+        data = json.dumps({'following_user': self.user2.pk})
+        response = self.client.post(reverse('follow'), data=data, content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual([posts[2], posts[1]], list(feed_posts(obj)))
+        self.assertEqual(2, UserFeed.objects.get(pk=self.user.pk).unread_count)
+
+    @override_settings(FEED_FOLLOW_BACKFILL=2)
+    def test_follow_backfill_read(self):
+        Post.objects.create(title='test title', text='test text', owner=self.user2)
+        post = Post.objects.create(title='test title', text='test text', owner=self.user2)
+        UserFeed.objects.create(user=self.user, read_until=post.date_create)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse('follow'), data=json.dumps({'following_user': self.user2.pk}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(2, UserFeed.objects.get(pk=self.user.pk).feed.count())
+        self.assertEqual(0, UserFeed.objects.get(pk=self.user.pk).unread_count)
+
+    def test_follow_no_backfill(self):
+        UserFeed.objects.create(user=self.user)
+        Post.objects.create(title='test title', text='test text', owner=self.user2)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse('follow'), data=json.dumps({'following_user': self.user2.pk}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(0, UserFeed.objects.get(pk=self.user.pk).feed.count())
+
     def test_userfeed_update_unfollow(self):
         obj = UserFeed.objects.create(user=self.user)
         self.assertEqual(0, UserFeed.objects.get(pk=self.user.pk).feed.count())
@@ -261,12 +655,58 @@ class FollowListCreateAPIViewAPITestCase(APITestCase):
         url = reverse('unfollow', args=(self.user2.pk,))
         response = self.client.delete(url)
         self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        self.assertEqual(1, feed_posts(obj).count())
+        self.assertEqual(1, FeedJob.objects.count())
+        run_next_job()
+        self.assertEqual(0, FeedJob.objects.count())
         self.assertEqual(1, UserFeed.objects.get(pk=self.user.pk).feed.count())
         self.assertEqual(UserFeed.objects.get(pk=self.user.pk).date_update, date)
 
+    def test_unfollow_unread_count(self):
+        obj = UserFeed.objects.create(user=self.user)
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        UserFollowing.objects.create(user=self.user, following_user=self.user3)
+        posts = [Post.objects.create(title=f'test title_{i}', text='test text', owner=self.user2) for i in range(3)]
+        post3 = Post.objects.create(title='test title', text='test text', owner=self.user3)
+        feed_fan_out([*posts, post3])
+        feed_mark_read(self.user.pk, [posts[0].pk])
+        self.client.force_authenticate(self.user)
+        response = self.client.delete(reverse('unfollow', args=(self.user2.pk,)))
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        self.assertEqual(1, UserFeed.objects.get(pk=self.user.pk).unread_count)
+        self.assertEqual([post3], list(feed_unread_posts(obj)))
+        run_next_job()
+        self.assertEqual([post3], list(UserFeed.objects.get(pk=self.user.pk).feed.all()))
+        self.assertEqual(0, obj.read.count())
+
+    def test_unfollow_refollow(self):
+        obj = UserFeed.objects.create(user=self.user)
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        posts = [Post.objects.create(title=f'test title_{i}', text='test text', owner=self.user2) for i in range(3)]
+        feed_fan_out(posts)
+        self.client.force_authenticate(self.user)
+        self.client.delete(reverse('unfollow', args=(self.user2.pk,)))
+        self.assertEqual(0, UserFeed.objects.get(pk=self.user.pk).unread_count)
+        response = self.client.post(reverse('follow'), data=json.dumps({'following_user': self.user2.pk}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(0, FeedJob.objects.count())
+        self.assertEqual(3, UserFeed.objects.get(pk=self.user.pk).unread_count)
+        self.assertEqual(3, feed_posts(obj).count())
+
+    def test_unfollow_no_feed(self):
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        self.client.force_authenticate(self.user)
+        response = self.client.delete(reverse('unfollow', args=(self.user2.pk,)))
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        self.assertEqual(0, UserFollowing.objects.count())
+        self.assertEqual(0, FeedJob.objects.count())
+
 
 class PostsFeedListAPIViewAPITestCase(APITestCase):
     def setUp(self):
+        cache.clear()
+        pending.clear()
         self.email = 'john.doe@example.com'
         self.password = '123456super'
         self.user = UserModel.objects.create_user(self.email, self.password)
@@ -296,6 +736,17 @@ class PostsFeedListAPIViewAPITestCase(APITestCase):
         for i in range(len(dct['results'])):
             self.assertEqual(dct['results'][i]['title'], a[i]['title'])
 
+    def test_feed_list_fields(self):
+        url = reverse('posts_feed')
+        self.client.force_authenticate(self.user)
+        for params in ({'fields': 'id,title', 'excerpt': 5}, {'fields': 'id,title', 'pagination': 'cursor'},
+                       {'fields': 'id,title', 'readed': 'false'}):
+            response = self.client.get(url, params)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual({'id', 'title'}, set(response.data['results'][0]))
+        response = self.client.get(url, {'excerpt': 5})
+        self.assertEqual('Test ', response.data['results'][0]['text'])
+
     def test_feed_list_filter_readed_true(self):
         obj = UserFeed.objects.get(pk=self.user.pk)
         obj.read.add(*obj.feed.all()[:5].values_list('id', flat=True))
@@ -327,6 +778,23 @@ class PostsFeedListAPIViewAPITestCase(APITestCase):
         for i in range(len(dct['results'])):
             self.assertEqual(dct['results'][i]['title'], a[i]['title'])
 
+    def test_feed_list_filter_read_until(self):
+        obj = UserFeed.objects.get(pk=self.user.pk)
+        posts = list(obj.feed.order_by('date_create'))
+        obj.read_until = posts[3].date_create
+        obj.save()
+        obj.read.add(posts[-1])
+        url = reverse('posts_feed')
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url, {'readed': 'false'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        dct = json.loads(response.content)
+        self.assertEqual([k.id for k in reversed(posts[4:-1])], [k['id'] for k in dct['results']])
+        response = self.client.get(url, {'readed': 'true'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        dct = json.loads(response.content)
+        self.assertEqual([posts[-1].id] + [k.id for k in reversed(posts[:4])], [k['id'] for k in dct['results']])
+
     def test_pagination(self):
         obj = UserFeed.objects.get(user=self.user)
         for i in range(10, 14):
@@ -341,19 +809,333 @@ class PostsFeedListAPIViewAPITestCase(APITestCase):
         self.assertEqual(10, len(dct['results']))
         self.assertIsNotNone(dct['next'])
 
+    def test_cursor_pagination(self):
+        obj = UserFeed.objects.get(user=self.user)
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        data = {'pagination': 'cursor', 'page_size': 4}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertFalse([q for q in queries.captured_queries if 'COUNT(' in q['sql']])
+        dct = json.loads(response.content)
+        self.assertNotIn('count', dct)
+        self.assertIsNone(dct['previous'])
+        posts = [k['id'] for k in dct['results']]
+
+        obj.feed.create(title='New post', text='Test text', owner=self.user2)
+        while dct['next']:
+            response = self.client.get(dct['next'])
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            dct = json.loads(response.content)
+            self.assertIsNotNone(dct['previous'])
+            posts += [k['id'] for k in dct['results']]
+        self.assertEqual(list(Post.objects.filter(title__startswith='Test post').
+                              order_by('-date_create', '-id').values_list('id', flat=True)), posts)
+
+        response = self.client.get(dct['previous'])
+        dct = json.loads(response.content)
+        self.assertEqual(posts[4:8], [k['id'] for k in dct['results']])
+
+    @override_settings(POST_ARCHIVE_AGE=timedelta(days=30))
+    def test_cursor_pagination_archive(self):
+        UserFollowing.objects.filter(user=self.user).update(created=timezone.now() - timedelta(days=100))
+        old = Post.objects.order_by('id')[:3]
+        Post.objects.filter(pk__in=[post.pk for post in old]).update(date_create=timezone.now() - timedelta(days=40))
+        posts = list(Post.objects.order_by('-date_create', '-id').values_list('id', flat=True))
+        feed_rebuild_unread_count(UserFeed.objects.get(pk=self.user.pk))
+        feed_mark_read(self.user.pk, [posts[-1]])
+        posts_archive(timezone.now() - timedelta(days=30))
+        self.assertEqual(3, ArchivedPost.objects.count())
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        results, response = [], None
+        while response is None or response.data['next']:
+            response = self.client.get(response.data['next'] if response else url,
+                                       {} if response else {'pagination': 'cursor', 'page_size': 4})
+            results += [k['id'] for k in response.data['results']]
+        self.assertEqual(posts, results)
+        # The archived posts keep their read state.
+        response = self.client.get(url, {'pagination': 'cursor', 'readed': 'true', 'page_size': 100})
+        self.assertEqual(posts[-1:], [k['id'] for k in response.data['results']])
+        response = self.client.get(url, {'pagination': 'cursor', 'readed': 'false', 'page_size': 100})
+        self.assertEqual(posts[:-1], [k['id'] for k in response.data['results']])
+        self.assertEqual(8, self.client.get(reverse('posts_unread')).data['unread_count'])
+
+        # The page numbers list the archived posts after the others.
+        results, response = [], None
+        while response is None or response.data['next']:
+            response = self.client.get(response.data['next'] if response else url, {} if response else {'page_size': 4})
+            self.assertEqual(9, response.data['count'])
+            results += [k['id'] for k in response.data['results']]
+        self.assertEqual(sorted(posts[:-3]), sorted(results[:-3]))
+        self.assertEqual(sorted(posts[-3:]), sorted(results[-3:]))
+        response = self.client.get(url, {'readed': 'false', 'page_size': 100})
+        self.assertEqual(8, response.data['count'])
+
+        response = self.client.get(reverse('post_read', args=(posts[-2],)))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(posts[-2], response.data['id'])
+        response = self.client.post(reverse('posts_read'), data=json.dumps({'ids': [posts[0], posts[-3]]}),
+                                    content_type='application/json')
+        self.assertEqual([posts[0], posts[-3]], response.data['ids'])
+        self.assertEqual(5, self.client.get(reverse('posts_unread')).data['unread_count'])
+        response = self.client.get(url, {'readed': 'false', 'page_size': 100})
+        self.assertEqual(posts[1:-3], [k['id'] for k in response.data['results']])
+
+    @override_settings(FEED_FAN_OUT_THRESHOLD=1)
+    def test_cursor_pagination_pulled(self):
+        obj = UserFeed.objects.get(user=self.user)
+        for i in range(3):
+            feed_fan_out([Post.objects.create(title=f'Pulled title_{i}', text='Test text', owner=self.user2)])
+            obj.feed.create(title=f'Test post title_{i}', text='Test text', owner=self.user2)
+        self.assertFalse(FeedPost.objects.exclude(date_create=F('post__date_create')).exists())
+        feed_mark_read(self.user.pk, list(Post.objects.filter(title__endswith='_1').values_list('id', flat=True)))
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        for readed, posts in ((None, feed_posts(obj)), ('true', feed_read_posts(obj)),
+                              ('false', feed_unread_posts(obj))):
+            with self.subTest(readed=readed):
+                data = {'pagination': 'cursor', 'page_size': 2, **({'readed': readed} if readed else {})}
+                pages, response = [], None
+                while response is None or response.data['next']:
+                    response = self.client.get(response.data['next'] if response else url, {} if response else data)
+                    pages.append([k['id'] for k in response.data['results']])
+                self.assertEqual(list(posts.order_by('-date_create', '-id').values_list('id', flat=True)),
+                                 sum(pages, []))
+                response = self.client.get(response.data['previous'])
+                self.assertEqual(pages[-2], [k['id'] for k in response.data['results']])
+
+    def test_cursor_pagination_invalid(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        response = self.client.get(url, {'pagination': 'cursor', 'cursor': 'cD0xfDI='})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
     def test_feed_update(self):
         date = UserFeed.objects.get(user=self.user).date_update
         posts = UserFeed.objects.get(user=self.user).feed.count()
         sleep(1)
-        Post.objects.create(title='Test title', text='Test text', owner=self.user2)
+        self.client.force_authenticate(self.user2)
+        data = {'title': 'Test title', 'text': 'Test text'}
+        response = self.client.post(reverse('post_create'), data=json.dumps(data),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual((posts + 1), UserFeed.objects.get(user=self.user).feed.count())
         self.client.force_authenticate(self.user)
         url = reverse('posts_feed')
         response = self.client.get(url)
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual((posts + 1), UserFeed.objects.get(user=self.user).feed.count())
-        self.assertGreater(UserFeed.objects.get(user=self.user).date_update, date)
+        self.assertEqual(UserFeed.objects.get(user=self.user).date_update, date)
         dct = json.loads(response.content)
-        self.assertEqual(dct['results'][0]['title'], UserFeed.objects.get(user=self.user).feed.first().title)
+        self.assertEqual(dct['results'][0]['title'], 'Test title')
+
+    @override_settings(FEED_FAN_OUT_THRESHOLD=1)
+    def test_feed_list_pulled_posts(self):
+        user3 = UserModel.objects.create_user('jax.doe@example.com', '123456super')
+        Post.objects.create(title='Before follow', text='Test text', owner=user3, fan_out=False)
+        UserFollowing.objects.create(user=self.user, following_user=user3)
+        self.client.force_authenticate(user3)
+        data = {'title': 'Pulled post', 'text': 'Test text'}
+        response = self.client.post(reverse('post_create'), data=json.dumps(data),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertFalse(Post.objects.get(pk=response.data['id']).fan_out)
+        self.assertEqual(9, UserFeed.objects.get(pk=self.user.pk).feed.count())
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('posts_feed'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        dct = json.loads(response.content)
+        self.assertEqual(10, dct['count'])
+        self.assertEqual(['Pulled post'] + [f'Test post title_{i}' for i in range(9, 0, -1)],
+                         [k['title'] for k in dct['results']])
+
+    def test_feed_list_read_only(self):
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts_feed'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(all(q['sql'].startswith('SELECT') for q in queries.captured_queries))
+
+    @override_settings(FEED_REFRESH_INTERVAL=timedelta(minutes=5))
+    def test_feed_list_refresh(self):
+        UserFeed.objects.filter(pk=self.user.pk).update(date_update=timezone.now() - timedelta(minutes=10))
+        post = Post.objects.create(title='Test title', text='Test text', owner=self.user2)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('posts_feed'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(post.id, json.loads(response.content)['results'][0]['id'])
+        obj = UserFeed.objects.get(pk=self.user.pk)
+        self.assertGreater(obj.date_update, timezone.now() - timedelta(minutes=1))
+        post2 = Post.objects.create(title='Test title', text='Test text', owner=self.user2)
+        response = self.client.get(reverse('posts_feed'))
+        self.assertNotIn(post2.id, [k['id'] for k in json.loads(response.content)['results']])
+        self.assertEqual(obj.date_update, UserFeed.objects.get(pk=self.user.pk).date_update)
+
+    @override_settings(FEED_REFRESH_INTERVAL=timedelta(minutes=5))
+    def test_feed_refresh_concurrent(self):
+        date = timezone.now() - timedelta(minutes=10)
+        UserFeed.objects.filter(pk=self.user.pk).update(date_update=date)
+        obj = UserFeed.objects.get(pk=self.user.pk)
+        post = Post.objects.create(title='Test title', text='Test text', owner=self.user2)
+        UserFeed.objects.filter(pk=self.user.pk).update(date_update=date + timedelta(seconds=1))
+        feed_refresh(obj)
+        self.assertFalse(obj.feed.filter(pk=post.pk).exists())
+
+    def test_feed_list_cache(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        response = self.client.get(url, {'page_size': 5})
+        self.assertEqual((0, 1), feed_cache_stats())
+        with self.assertNumQueries(1):
+            cached = self.client.get(url, {'page_size': 5})
+        self.assertEqual((1, 1), feed_cache_stats())
+        self.assertEqual(json.loads(response.content), json.loads(cached.content))
+        response = self.client.get(url, {'page_size': 5, 'page': 2})
+        self.assertEqual((1, 2), feed_cache_stats())
+        self.assertEqual(4, len(json.loads(response.content)['results']))
+
+    def test_feed_list_cache_invalidate(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        self.client.get(url, {'readed': 'false'})
+        post = Post.objects.create(title='Test title', text='Test text', owner=self.user2)
+        feed_fan_out([post])
+        response = self.client.get(url, {'readed': 'false'})
+        self.assertEqual(post.id, json.loads(response.content)['results'][0]['id'])
+        self.client.post(reverse('posts_read'), data=json.dumps({'ids': [post.id]}),
+                         content_type='application/json')
+        response = self.client.get(url, {'readed': 'false'})
+        self.assertNotIn(post.id, [k['id'] for k in json.loads(response.content)['results']])
+        self.client.delete(reverse('unfollow', args=(self.user2.pk,)))
+        response = self.client.get(url, {'readed': 'false'})
+        self.assertEqual(0, json.loads(response.content)['count'])
+        self.assertEqual((0, 4), feed_cache_stats())
+
+    @override_settings(FEED_FAN_OUT_THRESHOLD=1)
+    def test_feed_list_cache_pulled(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        self.client.get(url)
+        post = Post.objects.create(title='Test title', text='Test text', owner=self.user2)
+        feed_fan_out([post])
+        self.assertEqual(1, FeedCacheState.objects.get().pulled)
+        response = self.client.get(url)
+        self.assertEqual(post.id, json.loads(response.content)['results'][0]['id'])
+        post.delete()
+        self.assertEqual(2, FeedCacheState.objects.get().pulled)
+        response = self.client.get(url)
+        self.assertNotEqual(post.id, json.loads(response.content)['results'][0]['id'])
+        self.assertEqual((0, 3), feed_cache_stats())
+
+    def test_feed_list_cache_pulled_shared(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        etag = self.client.get(url)['ETag']
+        # Moved by another process, the pages cached by this one are not used.
+        FeedCacheState.add(pulled=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        self.assertEqual((0, 2), feed_cache_stats())
+
+    @override_settings(FEED_CACHE_STATS_BATCH=2)
+    def test_feed_list_cache_stats_batch(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        self.client.get(url)
+        self.assertFalse(FeedCacheState.objects.exists())
+        self.client.get(url)
+        self.assertEqual((1, 1), FeedCacheState.objects.values_list('hits', 'misses').get())
+        self.client.get(url)
+        self.assertEqual((2, 1), feed_cache_stats())
+
+    def test_feed_list_cache_delete(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        posts = [k['id'] for k in json.loads(self.client.get(url).content)['results']]
+        Post.objects.get(pk=posts[0]).delete()
+        response = self.client.get(url)
+        self.assertEqual(posts[1:], [k['id'] for k in json.loads(response.content)['results']])
+        Post.objects.filter(pk__in=posts[1:3]).delete()
+        response = self.client.get(url)
+        self.assertEqual(posts[3:], [k['id'] for k in json.loads(response.content)['results']])
+        self.assertEqual((0, 3), feed_cache_stats())
+
+    @override_settings(FEED_REFRESH_INTERVAL=timedelta(0))
+    def test_feed_list_cache_refresh(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        self.assertEqual(9, json.loads(self.client.get(url).content)['count'])
+        # Not delivered, the refresh adds it to the feed.
+        post = Post.objects.create(title='Test title', text='Test text', owner=self.user2)
+        response = self.client.get(url)
+        self.assertEqual(10, json.loads(response.content)['count'])
+        self.assertEqual(post.id, json.loads(response.content)['results'][0]['id'])
+
+    @override_settings(FEED_CACHE_TIMEOUT=0)
+    def test_feed_list_no_cache(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual((0, 0), feed_cache_stats())
+
+    def test_feed_list_etag(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        response = self.client.get(url, {'readed': 'false'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.client.post(reverse('posts_read'), data=json.dumps({'ids': [response.data['results'][0]['id']]}),
+                         content_type='application/json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+
+    def test_feed_list_etag_edit(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        response = self.client.get(url)
+        etag = response['ETag']
+        post = Post.objects.get(pk=response.data['results'][0]['id'])
+        post.title = 'Edited title'
+        post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        self.assertEqual('Edited title', response.data['results'][0]['title'])
+
+    @override_settings(FEED_FAN_OUT_THRESHOLD=1)
+    def test_feed_list_etag_edit_pulled(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        post = Post.objects.create(title='Test title', text='Test text', owner=self.user2)
+        feed_fan_out([post])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(post.id, response.data['results'][0]['id'])
+        post.refresh_from_db()
+        post.title = 'Edited title'
+        post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('Edited title', response.data['results'][0]['title'])
+
+    def test_feed_list_no_feed(self):
+        UserFeed.objects.filter(user=self.user).delete()
+        url = reverse('posts_feed')
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(0, json.loads(response.content)['count'])
+        self.assertFalse(UserFeed.objects.filter(user=self.user).exists())
 
 
 class PostFeedRetrieveAPIViewAPITestCase(APITestCase):
@@ -398,6 +1180,173 @@ class PostFeedRetrieveAPIViewAPITestCase(APITestCase):
         self.assertEqual(1, UserFeed.objects.get().read.count())
         self.assertEqual(Post.objects.get(owner=self.user2), UserFeed.objects.get().read.last())
 
+    def test_read_add_queries(self):
+        url = reverse('post_read', args=(UserFeed.objects.get().feed.values_list('id', flat=True)))
+        self.client.force_authenticate(self.user)
+        # The post, then the feed row is locked in a savepoint, the unread post is counted, added and subtracted.
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(1, UserFeed.objects.get().read.count())
+
+    def test_read_below_read_until(self):
+        obj = UserFeed.objects.get()
+        obj.read_until = obj.feed.get().date_create
+        obj.save()
+        url = reverse('post_read', args=(obj.feed.values_list('id', flat=True)))
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(0, UserFeed.objects.get().read.count())
+
+    def test_retrieve_no_feed(self):
+        url = reverse('post_read', args=(UserFeed.objects.get().feed.values_list('id', flat=True)))
+        self.client.force_authenticate(self.user2)
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+
+class PostsFeedReadAPIViewAPITestCase(APITestCase):
+    def setUp(self):
+        self.email = 'john.doe@example.com'
+        self.password = '123456super'
+        self.user = UserModel.objects.create_user(self.email, self.password)
+
+        self.email2 = 'jane.doe@example.com'
+        self.password2 = '123456super'
+        self.user2 = UserModel.objects.create_user(self.email2, self.password2)
+
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        self.obj = UserFeed.objects.create(user=self.user)
+        self.posts = [self.obj.feed.create(title=f'Test post title_{i}', text=f'Test post text_{i}',
+                                           owner=self.user2) for i in range(5)]
+        self.other = Post.objects.create(title='Not in feed', text='Test text', owner=self.user2)
+
+    def test_read_noauth(self):
+        url = reverse('posts_read')
+        response = self.client.post(url, data=json.dumps({'ids': [self.posts[0].pk]}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+
+    def test_read_ids(self):
+        url = reverse('posts_read')
+        ids = [self.posts[1].pk, self.posts[3].pk, self.other.pk]
+        self.client.force_authenticate(self.user)
+        response = self.client.post(url, data=json.dumps({'ids': ids}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({self.posts[1].pk, self.posts[3].pk}, set(response.data['ids']))
+        self.assertEqual({self.posts[1].pk, self.posts[3].pk},
+                         set(UserFeed.objects.get().read.values_list('id', flat=True)))
+
+        response = self.client.post(url, data=json.dumps({'ids': ids}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([], response.data['ids'])
+        self.assertEqual(2, UserFeed.objects.get().read.count())
+
+    def test_read_until(self):
+        self.obj.read.add(self.posts[1], self.posts[4])
+        url = reverse('posts_read')
+        until = self.posts[2].date_create
+        self.client.force_authenticate(self.user)
+        response = self.client.post(url, data=json.dumps({'until': until.isoformat()}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        obj = UserFeed.objects.get()
+        self.assertEqual(until, obj.read_until)
+        self.assertEqual([self.posts[4]], list(obj.read.all()))
+
+    def test_read_invalid(self):
+        url = reverse('posts_read')
+        self.client.force_authenticate(self.user)
+        for data in ({}, {'ids': []}, {'ids': [self.posts[0].pk], 'until': self.posts[0].date_create.isoformat()}):
+            response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class PostsFeedUnreadAPIViewAPITestCase(APITestCase):
+    def setUp(self):
+        self.email = 'john.doe@example.com'
+        self.password = '123456super'
+        self.user = UserModel.objects.create_user(self.email, self.password)
+
+        self.email2 = 'jane.doe@example.com'
+        self.password2 = '123456super'
+        self.user2 = UserModel.objects.create_user(self.email2, self.password2)
+
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        UserFeed.objects.create(user=self.user)
+        self.client.force_authenticate(self.user2)
+        for i in range(4):
+            data = {'title': f'Test post title_{i}', 'text': f'Test post text_{i}'}
+            self.client.post(reverse('post_create'), data=json.dumps(data), content_type='application/json')
+        self.client.force_authenticate(self.user)
+
+    def get_unread_count(self):
+        response = self.client.get(reverse('posts_unread'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response.data['unread_count']
+
+    def test_unread_noauth(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(reverse('posts_unread'))
+        self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+
+    def test_unread_fan_out(self):
+        self.assertEqual(4, UserFeed.objects.get().unread_count)
+        with self.assertNumQueries(1):
+            self.assertEqual(4, self.get_unread_count())
+
+    def test_unread_no_feed(self):
+        self.client.force_authenticate(self.user2)
+        self.assertEqual(0, self.get_unread_count())
+
+    def test_unread_mark_read(self):
+        posts = list(UserFeed.objects.get().feed.order_by('date_create'))
+        self.client.get(reverse('post_read', args=(posts[3].pk,)))
+        self.client.get(reverse('post_read', args=(posts[3].pk,)))
+        self.assertEqual(3, self.get_unread_count())
+        self.client.post(reverse('posts_read'), data=json.dumps({'ids': [posts[2].pk, posts[3].pk]}),
+                         content_type='application/json')
+        self.assertEqual(2, self.get_unread_count())
+        self.client.post(reverse('posts_read'), data=json.dumps({'until': posts[1].date_create.isoformat()}),
+                         content_type='application/json')
+        self.assertEqual(0, self.get_unread_count())
+
+    def test_unread_mark_read_twice(self):
+        obj = UserFeed.objects.get()
+        posts = list(obj.feed.order_by('date_create'))
+        for _ in range(2):
+            feed_mark_read(self.user.pk, [posts[2].pk, posts[3].pk])
+        self.assertEqual(2, UserFeed.objects.get().unread_count)
+        # The posts covered by the read mark are not counted again.
+        feed_mark_read_until(obj, posts[1].date_create)
+        feed_mark_read(self.user.pk, [posts[0].pk])
+        obj = UserFeed.objects.get()
+        self.assertEqual(0, obj.unread_count)
+        self.assertEqual((0, 0), feed_rebuild_unread_count(obj, save=False))
+
+    def test_unread_unfollow(self):
+        self.client.delete(reverse('unfollow', args=(self.user2.pk,)))
+        self.assertEqual(0, self.get_unread_count())
+
+    @override_settings(FEED_FAN_OUT_THRESHOLD=1)
+    def test_unread_pulled(self):
+        self.client.force_authenticate(self.user2)
+        data = {'title': 'Pulled post', 'text': 'Test post text'}
+        self.client.post(reverse('post_create'), data=json.dumps(data), content_type='application/json')
+        self.client.force_authenticate(self.user)
+        self.assertEqual(4, UserFeed.objects.get().unread_count)
+        with self.assertNumQueries(1):
+            self.assertEqual(5, self.get_unread_count())
+        pulled = Post.objects.get(fan_out=False)
+        self.client.get(reverse('post_read', args=(pulled.pk,)))
+        self.assertEqual(4, self.get_unread_count())
+
 
 class UsersListAPIViewAPITestCase(APITestCase):
     def setUp(self):
@@ -410,28 +1359,37 @@ class UsersListAPIViewAPITestCase(APITestCase):
         self.user2 = UserModel.objects.create_user(self.email2, self.password2)
 
     def test_get(self):
-        users = UserModel.objects.all().annotate(
-            posts_count=Count('posts')
-        )
+        users = UserModel.objects.all()
         url = reverse('users_list')
         response = self.client.get(url)
         serializer_data = UserListSerializer(users, many=True).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(serializer_data, response.data)
+        self.assertEqual(serializer_data, response.data['results'])
 
     def test_posts_count(self):
-        users = UserModel.objects.all().annotate(
-            posts_count=Count('posts')
-        )
         self.assertEqual(0, self.user.posts.count())
         url = reverse('users_list')
         self.user.posts.create(title='title for test post', text='text for test post')
         response = self.client.get(url)
+        users = UserModel.objects.all()
         serializer_data = UserListSerializer(users, many=True).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(serializer_data, response.data)
+        self.assertEqual(serializer_data, response.data['results'])
+        self.assertEqual(1, response.data['results'][0]['posts_count'])
         self.assertEqual(1, self.user.posts.count())
 
+    def test_posts_count_update(self):
+        post = self.user.posts.create(title='title for test post', text='text for test post')
+        Post.objects.bulk_create([Post(title=f'title_{i}', text=f'text_{i}', owner=owner)
+                                  for i, owner in enumerate([self.user, self.user2, self.user2])])
+        self.assertEqual([2, 2], list(UserModel.objects.order_by('id').values_list('posts_count', flat=True)))
+        post.title = 'new title'
+        post.save()
+        post.delete()
+        self.assertEqual(1, UserModel.objects.get(pk=self.user.pk).posts_count)
+        Post.objects.filter(owner=self.user2).delete()
+        self.assertEqual([1, 0], list(UserModel.objects.order_by('id').values_list('posts_count', flat=True)))
+
     def test_posts_ordering(self):
         url = reverse('users_list')
         for i in range(1, 4):
@@ -439,7 +1397,7 @@ class UsersListAPIViewAPITestCase(APITestCase):
         self.user2.posts.create(title='title for test post', text='text for test post')
         response = self.client.get(url, {'ordering': '-posts_count'})
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        dct = json.loads(response.content)
+        dct = json.loads(response.content)['results']
         self.assertEqual(2, len(dct))
         self.assertEqual(self.user.pk, dct[0]['id'])
         self.assertEqual(self.user2.pk, dct[1]['id'])
@@ -447,8 +1405,69 @@ class UsersListAPIViewAPITestCase(APITestCase):
 
         response = self.client.get(url, {'ordering': 'posts_count'})
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        dct = json.loads(response.content)
+        dct = json.loads(response.content)['results']
         self.assertEqual(2, len(dct))
         self.assertEqual(self.user2.pk, dct[0]['id'])
         self.assertEqual(self.user.pk, dct[1]['id'])
         self.assertEqual(1, self.user2.posts.count())
+
+    def test_pagination(self):
+        UserModel.objects.bulk_create([UserModel(email=f'user_{i}@example.com') for i in range(11)])
+        url = reverse('users_list')
+        response = self.client.get(url, {'ordering': '-posts_count'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(13, response.data['count'])
+        self.assertEqual(10, len(response.data['results']))
+        response2 = self.client.get(url, {'ordering': '-posts_count', 'page': 2})
+        ids = [k['id'] for k in response.data['results'] + response2.data['results']]
+        self.assertEqual(sorted(UserModel.objects.values_list('id', flat=True), reverse=True), ids)
+
+
+class UserProfileAPIViewAPITestCase(APITestCase):
+    def setUp(self):
+        self.email = 'john.doe@example.com'
+        self.password = '123456super'
+        self.user = UserModel.objects.create_user(self.email, self.password)
+
+        self.email2 = 'jane.doe@example.com'
+        self.password2 = '123456super'
+        self.user2 = UserModel.objects.create_user(self.email2, self.password2)
+
+        self.email3 = 'jax.doe@example.com'
+        self.password3 = '123456super'
+        self.user3 = UserModel.objects.create_user(self.email3, self.password3)
+
+    def test_profile(self):
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        UserFollowing.objects.create(user=self.user3, following_user=self.user2)
+        self.user2.posts.create(title='title for test post', text='text for test post')
+        url = reverse('user_profile', args=(self.user2.pk,))
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'id': self.user2.pk, 'email': self.email2, 'posts_count': 1,
+                          'followers_count': 2, 'following_count': 0}, response.data)
+
+    def test_profile_not_found(self):
+        response = self.client.get(reverse('user_profile', args=(self.user3.pk + 10,)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        self.assertEqual({'error': ErrorDetail(string='User not found', code='not_found')}, response.data)
+
+    def test_follow_counts(self):
+        self.client.force_authenticate(self.user)
+        for user in (self.user2, self.user3):
+            response = self.client.post(reverse('follow'), data=json.dumps({'following_user': user.pk}),
+                                        content_type='application/json')
+            self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        response = self.client.post(reverse('follow'), data=json.dumps({'following_user': self.user2.pk}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual(2, UserModel.objects.get(pk=self.user.pk).following_count)
+        self.assertEqual(1, UserModel.objects.get(pk=self.user2.pk).followers_count)
+        response = self.client.delete(reverse('unfollow', args=(self.user2.pk,)))
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        self.assertEqual(1, UserModel.objects.get(pk=self.user.pk).following_count)
+        self.assertEqual(0, UserModel.objects.get(pk=self.user2.pk).followers_count)
+        UserFollowing.objects.all().delete()
+        self.assertEqual(0, UserModel.objects.get(pk=self.user.pk).following_count)
+        self.assertEqual(0, UserModel.objects.get(pk=self.user3.pk).followers_count)
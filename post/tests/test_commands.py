@@ -0,0 +1,422 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from post.cache import pending
+from post.fields import COMPRESSED_PREFIX
+from post.imports import import_records, read_records
+from post.models import Post, UserFollowing, UserFeed, FeedJob, ArchivedPost, ArchivedFeedPost, ArchivedReadPost, \
+    FeedCacheState
+from post.utils import feed_read_posts, feed_unread_posts, feed_rebuild_unread_count, feed_purge
+
+UserModel = get_user_model()
+
+
+class CompactReadMarksTestCase(TestCase):
+    def setUp(self):
+        email = 'john.doe@example.com'
+        password = '123456super'
+        self.user = UserModel.objects.create_user(email, password)
+
+        email2 = 'jane.doe@example.com'
+        password2 = '123456super'
+        self.user2 = UserModel.objects.create_user(email2, password2)
+
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        self.obj = UserFeed.objects.create(user=self.user)
+        self.posts = [self.obj.feed.create(title=f'Test title_{i}', text=f'Test text_{i}', owner=self.user2)
+                      for i in range(6)]
+
+    def test_compact(self):
+        self.obj.read.add(*self.posts[:3], self.posts[5])
+        read = set(feed_read_posts(self.obj).values_list('id', flat=True))
+        out = StringIO()
+        call_command('compact_read_marks', stdout=out)
+        self.assertIn('Compacted 1 feeds.', out.getvalue())
+        obj = UserFeed.objects.get(pk=self.user.pk)
+        self.assertEqual(self.posts[2].date_create, obj.read_until)
+        self.assertEqual([self.posts[5]], list(obj.read.all()))
+        self.assertEqual(read, set(feed_read_posts(obj).values_list('id', flat=True)))
+        self.assertEqual([self.posts[4], self.posts[3]], list(feed_unread_posts(obj)))
+
+    def test_compact_all_read(self):
+        self.obj.read.add(*self.posts)
+        call_command('compact_read_marks', stdout=StringIO())
+        obj = UserFeed.objects.get(pk=self.user.pk)
+        self.assertEqual(self.posts[5].date_create, obj.read_until)
+        self.assertEqual(0, obj.read.count())
+        self.assertEqual(6, feed_read_posts(obj).count())
+        self.assertEqual(0, feed_unread_posts(obj).count())
+
+    def test_compact_nothing_read(self):
+        self.obj.read.add(self.posts[3])
+        call_command('compact_read_marks', stdout=StringIO())
+        obj = UserFeed.objects.get(pk=self.user.pk)
+        self.assertIsNone(obj.read_until)
+        self.assertEqual([self.posts[3]], list(obj.read.all()))
+
+
+class RebuildUnreadCountsTestCase(TestCase):
+    def setUp(self):
+        email = 'john.doe@example.com'
+        password = '123456super'
+        self.user = UserModel.objects.create_user(email, password)
+
+        email2 = 'jane.doe@example.com'
+        password2 = '123456super'
+        self.user2 = UserModel.objects.create_user(email2, password2)
+
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        self.obj = UserFeed.objects.create(user=self.user, unread_count=10)
+        posts = [self.obj.feed.create(title=f'Test title_{i}', text=f'Test text_{i}', owner=self.user2)
+                 for i in range(3)]
+        self.obj.read.add(posts[0])
+
+    def test_check(self):
+        out = StringIO()
+        call_command('rebuild_unread_counts', '--check', stdout=out)
+        self.assertIn('unread_count 10, actual 2', out.getvalue())
+        self.assertIn('Checked 1 feeds, found 1 wrong counters.', out.getvalue())
+        self.assertEqual(10, UserFeed.objects.get().unread_count)
+
+    def test_rebuild(self):
+        out = StringIO()
+        call_command('rebuild_unread_counts', stdout=out)
+        self.assertIn('Checked 1 feeds, fixed 1 wrong counters.', out.getvalue())
+        self.assertEqual(2, UserFeed.objects.get().unread_count)
+
+
+class RunFeedJobsTestCase(TestCase):
+    def setUp(self):
+        email = 'john.doe@example.com'
+        password = '123456super'
+        self.user = UserModel.objects.create_user(email, password)
+
+        email2 = 'jane.doe@example.com'
+        password2 = '123456super'
+        self.user2 = UserModel.objects.create_user(email2, password2)
+
+        self.obj = UserFeed.objects.create(user=self.user)
+        posts = [self.obj.feed.create(title=f'Test title_{i}', text=f'Test text_{i}', owner=self.user2)
+                 for i in range(5)]
+        self.obj.read.add(*posts[:3])
+        FeedJob.objects.create(action=FeedJob.PURGE, user=self.user, author=self.user2)
+
+    def test_purge(self):
+        out = StringIO()
+        call_command('run_feed_jobs', '--once', '--batch-size', '2', stdout=out)
+        self.assertIn('Done 1 jobs, 0 failed.', out.getvalue())
+        self.assertEqual(0, self.obj.feed.count())
+        self.assertEqual(0, self.obj.read.count())
+        self.assertEqual(0, FeedJob.objects.count())
+
+    def test_purge_refollowed(self):
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        call_command('run_feed_jobs', '--once', stdout=StringIO())
+        self.assertEqual(5, self.obj.feed.count())
+        self.assertEqual(3, self.obj.read.count())
+
+    def test_locked(self):
+        FeedJob.objects.update(locked_until=timezone.now() + timedelta(minutes=1))
+        out = StringIO()
+        call_command('run_feed_jobs', '--once', stdout=out)
+        self.assertIn('Done 0 jobs, 0 failed.', out.getvalue())
+        self.assertEqual(5, self.obj.feed.count())
+
+    def test_failed(self):
+        with mock.patch('post.jobs.feed_purge', side_effect=RuntimeError('boom')):
+            out, err = StringIO(), StringIO()
+            call_command('run_feed_jobs', '--once', stdout=out, stderr=err)
+        self.assertIn('Done 0 jobs, 1 failed.', out.getvalue())
+        self.assertIn('boom', err.getvalue())
+        job = FeedJob.objects.get()
+        self.assertEqual(1, job.attempts)
+        self.assertIsNotNone(job.locked_until)
+        self.assertIn('boom', job.error)
+
+
+class ReconcileUserCountersTestCase(TestCase):
+    def setUp(self):
+        email = 'john.doe@example.com'
+        password = '123456super'
+        self.user = UserModel.objects.create_user(email, password)
+
+        email2 = 'jane.doe@example.com'
+        password2 = '123456super'
+        self.user2 = UserModel.objects.create_user(email2, password2)
+
+        for i in range(3):
+            self.user.posts.create(title=f'Test title_{i}', text=f'Test text_{i}')
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        UserModel.objects.filter(pk=self.user.pk).update(posts_count=5)
+        UserModel.objects.filter(pk=self.user2.pk).update(followers_count=3, following_count=1)
+
+    def test_check(self):
+        out = StringIO()
+        call_command('reconcile_user_counters', '--check', stdout=out)
+        self.assertIn('posts_count 5, actual 3', out.getvalue())
+        self.assertIn('followers_count 3, actual 1', out.getvalue())
+        self.assertIn('following_count 1, actual 0', out.getvalue())
+        self.assertIn('Found 2 users with wrong counters.', out.getvalue())
+        self.assertEqual(5, UserModel.objects.get(pk=self.user.pk).posts_count)
+
+    def test_reconcile(self):
+        out = StringIO()
+        call_command('reconcile_user_counters', stdout=out)
+        self.assertIn('Fixed 2 users with wrong counters.', out.getvalue())
+        user, user2 = UserModel.objects.get(pk=self.user.pk), UserModel.objects.get(pk=self.user2.pk)
+        self.assertEqual((3, 0, 1), (user.posts_count, user.followers_count, user.following_count))
+        self.assertEqual((0, 1, 0), (user2.posts_count, user2.followers_count, user2.following_count))
+        out = StringIO()
+        call_command('reconcile_user_counters', '--check', stdout=out)
+        self.assertIn('Found 0 users with wrong counters.', out.getvalue())
+
+
+class FeedCacheStatsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        pending.clear()
+        self.user = UserModel.objects.create_user('john.doe@example.com', '123456super')
+        UserFeed.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(FEED_CACHE_STATS_BATCH=1)
+    def test_stats(self):
+        self.client.get(reverse('posts_feed'))
+        self.client.get(reverse('posts_feed'))
+        self.assertEqual(0, sum(pending.values()))
+        out = StringIO()
+        call_command('feed_cache_stats', stdout=out)
+        self.assertIn('Hits: 1, misses: 1, hit ratio: 50.0%.', out.getvalue())
+        # Counted by another process.
+        FeedCacheState.add(hits=2)
+        out = StringIO()
+        call_command('feed_cache_stats', stdout=out)
+        self.assertIn('Hits: 3, misses: 1, hit ratio: 75.0%.', out.getvalue())
+
+    def test_stats_empty(self):
+        out = StringIO()
+        call_command('feed_cache_stats', stdout=out)
+        self.assertIn('Hits: 0, misses: 0, hit ratio: 0.0%.', out.getvalue())
+
+
+class CompressPostTextsTestCase(TestCase):
+    def setUp(self):
+        self.user = UserModel.objects.create_user('john.doe@example.com', '123456super')
+        self.long = Post.objects.create(title='Test title', text='Test text ' * 100, owner=self.user)
+        self.short = Post.objects.create(title='Test title', text='Test text', owner=self.user)
+
+    def stored(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT text FROM post_post WHERE id = %s', [post.pk])
+            return cursor.fetchone()[0]
+
+    def test_compress(self):
+        self.assertEqual('Test text ' * 100, self.stored(self.long))
+        out = StringIO()
+        with override_settings(POST_TEXT_COMPRESS_SIZE=100):
+            call_command('compress_post_texts', '--batch-size', '1', stdout=out)
+        self.assertIn('Compressed the texts of 1 posts.', out.getvalue())
+        self.assertTrue(self.stored(self.long).startswith(COMPRESSED_PREFIX))
+        self.assertEqual('Test text', self.stored(self.short))
+        self.assertEqual('Test text ' * 100, Post.objects.get(pk=self.long.pk).text)
+
+    def test_decompress(self):
+        with override_settings(POST_TEXT_COMPRESS_SIZE=100):
+            call_command('compress_post_texts', stdout=StringIO())
+        out = StringIO()
+        call_command('compress_post_texts', stdout=out)
+        self.assertIn('Decompressed the texts of 1 posts.', out.getvalue())
+        self.assertEqual('Test text ' * 100, self.stored(self.long))
+
+    @override_settings(POST_TEXT_COMPRESS_SIZE=100)
+    def test_not_sqlite(self):
+        field = Post._meta.get_field('text')
+        other = mock.Mock(vendor='postgresql')
+        for text in ('Test text ' * 100, f'{COMPRESSED_PREFIX}x'):
+            self.assertEqual(text, field.get_db_prep_value(text, other))
+            self.assertEqual(text, field.from_db_value(text, None, other))
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            call_command('compress_post_texts', stdout=StringIO())
+        self.assertEqual('Test text ' * 100, self.stored(self.long))
+
+
+class ImportDataTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def test_import(self):
+        users = self.write('users.ndjson', '\n'.join(json.dumps(record) for record in [
+            {'id': 10, 'email': 'john.doe@example.com', 'password': make_password('123456super')},
+            {'id': 11, 'email': 'jane.doe@example.com'},
+        ]))
+        posts = self.write('posts.csv', 'title,text,owner,date_create\n'
+                                        'Old title,Old text,11,2020-01-01T00:00:00Z\n'
+                                        'Test title,"Test, text",11,2022-01-01T00:00:00Z\n'
+                                        'Own title,Own text,10,\n')
+        follows = self.write('follows.ndjson', json.dumps({'user': 10, 'following_user': 11,
+                                                           'created': '2021-01-01T00:00:00Z'}))
+        out = StringIO()
+        call_command('import_data', '--users', users, '--posts', posts, '--follows', follows,
+                     '--batch-size', '2', stdout=out)
+        self.assertIn('Imported 3 posts.', out.getvalue())
+        self.assertIn('posts: 2 rows', out.getvalue())
+        self.assertTrue(self.client.login(email='john.doe@example.com', password='123456super'))
+        self.assertFalse(UserModel.objects.get(pk=11).has_usable_password())
+        old = Post.objects.get(title='Old title')
+        self.assertEqual(2020, old.date_create.year)
+        self.assertEqual('Test, text', Post.objects.get(title='Test title').text)
+        self.assertEqual((1, 2, 0), UserModel.objects.filter(pk=11).
+                         values_list('followers_count', 'posts_count', 'following_count').get())
+        self.assertEqual(1, UserModel.objects.get(pk=10).following_count)
+        feed = UserFeed.objects.get(pk=10)
+        self.assertEqual(['Test title'], [post.title for post in feed.feed.all()])
+        self.assertEqual(1, feed.unread_count)
+        user = UserModel.objects.create_user('jax.doe@example.com', '123456super')
+        self.assertGreater(user.pk, 11)
+
+    def test_import_existing_feed(self):
+        user = UserModel.objects.create_user('john.doe@example.com', '123456super')
+        user2 = UserModel.objects.create_user('jane.doe@example.com', '123456super')
+        UserFollowing.objects.create(user=user, following_user=user2)
+        UserFeed.objects.create(user=user, unread_count=0)
+        posts = self.write('posts.ndjson', '\n'.join(json.dumps({'title': f'Test title_{i}', 'text': 'Test text',
+                                                                 'owner': user2.pk}) for i in range(3)))
+        call_command('import_data', '--posts', posts, stdout=StringIO())
+        feed = UserFeed.objects.get(pk=user.pk)
+        self.assertEqual(3, feed.feed.count())
+        self.assertEqual(3, feed.unread_count)
+        self.assertEqual(3, UserModel.objects.get(pk=user2.pk).posts_count)
+        call_command('import_data', '--posts', posts, stdout=StringIO())
+        self.assertEqual(6, UserFeed.objects.get(pk=user.pk).unread_count)
+
+    def test_import_explicit_ids(self):
+        user = UserModel.objects.create_user('john.doe@example.com', '123456super')
+        user2 = UserModel.objects.create_user('jane.doe@example.com', '123456super')
+        Post.objects.bulk_create([Post(id=100 + i, title=f'Old title_{i}', text='Old text', owner=user2)
+                                  for i in range(2)])
+        # The counter of the user whose posts are not imported is not recounted.
+        UserModel.objects.filter(pk=user2.pk).update(posts_count=5)
+        posts = self.write('posts.ndjson', '\n'.join(json.dumps(record) for record in [
+            {'id': 10, 'title': 'Test title_1', 'text': 'Test text', 'owner': user.pk},
+            {'title': 'Test title_2', 'text': 'Test text', 'owner': user.pk},
+            {'id': 20, 'title': 'Test title_3', 'text': 'Test text', 'owner': user.pk},
+        ]))
+        call_command('import_data', '--posts', posts, stdout=StringIO())
+        self.assertEqual(3, UserModel.objects.get(pk=user.pk).posts_count)
+        self.assertEqual(5, UserModel.objects.get(pk=user2.pk).posts_count)
+        self.assertTrue(Post.objects.filter(pk__in=[10, 20]).exists())
+        self.assertGreater(Post.objects.get(title='Test title_2').pk, 101)
+
+    def test_import_duplicate_follows(self):
+        user = UserModel.objects.create_user('john.doe@example.com', '123456super')
+        user2 = UserModel.objects.create_user('jane.doe@example.com', '123456super')
+        user3 = UserModel.objects.create_user('jax.doe@example.com', '123456super')
+        UserFollowing.objects.create(user=user, following_user=user2)
+        follows = self.write('follows.csv', f'user,following_user\n'
+                                            f'{user.pk},{user2.pk}\n'
+                                            f'{user.pk},{user3.pk}\n'
+                                            f'{user.pk},{user3.pk}\n')
+        out = StringIO()
+        call_command('import_data', '--follows', follows, stdout=out)
+        self.assertIn('Imported 1 follows.', out.getvalue())
+        self.assertIn('Skipped 2 duplicate follows.', out.getvalue())
+        self.assertEqual(2, UserModel.objects.get(pk=user.pk).following_count)
+        self.assertEqual(1, UserModel.objects.get(pk=user3.pk).followers_count)
+
+    def test_import_dates(self):
+        user = UserModel.objects.create_user('john.doe@example.com', '123456super')
+        posts = self.write('posts.ndjson', json.dumps({'title': 'Test title', 'text': 'Test text', 'owner': user.pk,
+                                                       'date_create': '2020-01-01T00:00:00Z'}))
+        created = []
+
+        def progress(count, elapsed):
+            # The posts created during the import get their creation date.
+            created.append(Post.objects.create(title='New title', text='New text', owner=user))
+
+        import_records('posts', read_records(posts), 10, progress)
+        self.assertEqual(2020, Post.objects.get(title='Test title').date_create.year)
+        self.assertIsNotNone(created[0].date_create)
+        self.assertEqual(timezone.now().year, Post.objects.get(pk=created[0].pk).date_create.year)
+
+    def test_import_invalid(self):
+        posts = self.write('posts.ndjson', json.dumps({'title': 'Test title'}))
+        with self.assertRaisesMessage(CommandError, 'invalid record'):
+            call_command('import_data', '--posts', posts, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('import_data', stdout=StringIO())
+
+
+@override_settings(POST_ARCHIVE_AGE=timedelta(days=30))
+class ArchivePostsTestCase(TestCase):
+    def setUp(self):
+        self.user = UserModel.objects.create_user('john.doe@example.com', '123456super')
+        self.user2 = UserModel.objects.create_user('jane.doe@example.com', '123456super')
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        self.obj = UserFeed.objects.create(user=self.user)
+        self.posts = [self.obj.feed.create(title=f'Test title_{i}', text=f'Test text_{i}', owner=self.user2)
+                      for i in range(4)]
+        UserFollowing.objects.filter(user=self.user).update(created=timezone.now() - timedelta(days=100))
+        Post.objects.filter(pk__in=[post.pk for post in self.posts[:2]]). \
+            update(date_create=timezone.now() - timedelta(days=40))
+        self.obj.read.add(self.posts[0])
+        UserFeed.objects.filter(pk=self.user.pk).update(unread_count=3)
+
+    def test_archive(self):
+        out = StringIO()
+        call_command('archive_posts', '--batch-size', '1', stdout=out)
+        self.assertIn('Archived 2 posts.', out.getvalue())
+        self.assertEqual([post.pk for post in self.posts[:2]],
+                         sorted(ArchivedPost.objects.values_list('id', flat=True)))
+        self.assertEqual('Test text_1', ArchivedPost.objects.get(pk=self.posts[1].pk).text)
+        self.assertEqual(2, Post.objects.count())
+        self.assertEqual(4, UserModel.objects.get(pk=self.user2.pk).posts_count)
+        obj = UserFeed.objects.get(pk=self.user.pk)
+        self.assertEqual(2, obj.feed.count())
+        self.assertEqual(0, obj.read.count())
+        self.assertIsNone(obj.read_until)
+        # The archived posts stay read or unread.
+        self.assertEqual(2, ArchivedFeedPost.objects.filter(userfeed=obj).count())
+        self.assertEqual([self.posts[0].pk], list(ArchivedReadPost.objects.values_list('post_id', flat=True)))
+        self.assertEqual(3, obj.unread_count)
+        self.assertEqual((3, 3), feed_rebuild_unread_count(obj, save=False))
+        self.assertEqual(2, feed_unread_posts(obj).count())
+        self.assertEqual([self.posts[1].pk], [post.pk for post in feed_unread_posts(obj, archive=True)])
+        self.assertEqual([self.posts[0].pk], [post.pk for post in feed_read_posts(obj, archive=True)])
+        out = StringIO()
+        call_command('reconcile_user_counters', '--check', stdout=out)
+        self.assertIn('Found 0 users', out.getvalue())
+
+    def test_archive_purge(self):
+        call_command('archive_posts', stdout=StringIO())
+        UserFollowing.objects.filter(user=self.user).delete()
+        feed_purge(self.user.pk, self.user2.pk, 1)
+        self.assertEqual(0, ArchivedFeedPost.objects.count())
+        self.assertEqual(0, ArchivedReadPost.objects.count())
+        self.assertEqual(2, ArchivedPost.objects.count())
+
+    @override_settings(POST_ARCHIVE_AGE=None)
+    def test_archive_off(self):
+        with self.assertRaises(CommandError):
+            call_command('archive_posts', stdout=StringIO())
@@ -0,0 +1,269 @@
+import json
+import sys
+import timeit
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import tag, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from post.models import Post, UserFollowing, UserFeed, FeedPost
+from post.search import FTS_TABLE, PG_INDEX, search_posts
+from post.serializer import PostSerializer, PostValuesSerializer
+from post.utils import posts_version
+
+UserModel = get_user_model()
+
+SIZES = (10, 1000, 100000)
+
+
+@tag('performance')
+@override_settings(FEED_CACHE_TIMEOUT=0)
+class QueryBudgetTestCase(APITestCase):
+    """
+    Every endpoint must make the same number of queries and return at most a page of rows
+    whatever the number of posts, feed items and users is.
+    The data grows through SIZES inside each test, exclude the suite with --exclude-tag performance.
+    """
+
+    def setUp(self):
+        self.email = 'john.doe@example.com'
+        self.password = '123456super'
+        self.user = UserModel.objects.create_user(self.email, self.password)
+
+        self.email2 = 'jane.doe@example.com'
+        self.password2 = '123456super'
+        self.user2 = UserModel.objects.create_user(self.email2, self.password2)
+
+        UserFollowing.objects.create(user=self.user, following_user=self.user2)
+        self.feed = UserFeed.objects.create(user=self.user)
+        self.posts = 0
+        self.users = 0
+
+    def grow_posts(self, size):
+        """
+        Adds posts of the second user to the feed of the first one up to 'size'.
+        """
+        posts = Post.objects.bulk_create([Post(title=f'Test title_{i}', text=f'Test text_{i}', owner=self.user2)
+                                          for i in range(self.posts, size)], batch_size=5000)
+        through = UserFeed.feed.through
+        through.objects.bulk_create([through(userfeed_id=self.feed.pk, post_id=post.pk) for post in posts],
+                                    batch_size=5000)
+        UserFeed.objects.filter(pk=self.feed.pk).update(unread_count=size)
+        self.posts = size
+
+    def grow_users(self, size):
+        """
+        Adds users followed by the first user up to 'size'.
+        """
+        users = UserModel.objects.bulk_create([UserModel(email=f'user_{i}@example.com')
+                                               for i in range(self.users, size)], batch_size=5000)
+        UserFollowing.objects.bulk_create([UserFollowing(user=self.user, following_user=user) for user in users],
+                                          batch_size=5000)
+        self.users = size
+
+    def assertQueryBudget(self, grow, *requests, max_rows=100):
+        """
+        Runs the requests at every size and checks that the number of queries of each request
+        does not change and that the responses have at most 'max_rows' items.
+        """
+        budgets = [{} for _ in requests]
+        for size in SIZES:
+            grow(size)
+            for request, budget in zip(requests, budgets):
+                with CaptureQueriesContext(connection) as queries:
+                    response = request()
+                    # Streamed responses read the rows while their content is consumed.
+                    content = b''.join(response.streaming_content) if response.streaming else response.content
+                self.assertIn(response.status_code, (status.HTTP_200_OK, status.HTTP_201_CREATED))
+                data = json.loads(content)
+                if isinstance(data, dict):
+                    data = data.get('results', [data])
+                self.assertLessEqual(len(data), max_rows, f'{len(data)} rows at size {size}')
+                budget[size] = len(queries)
+        for budget in budgets:
+            self.assertEqual(1, len(set(budget.values())), f'Queries per size: {budget}')
+
+    def test_users_list(self):
+        url = reverse('users_list')
+        self.assertQueryBudget(self.grow_users, lambda: self.client.get(url, {'ordering': '-posts_count'}))
+
+    def test_user_profile(self):
+        url = reverse('user_profile', args=(self.user.pk,))
+        self.assertQueryBudget(self.grow_users, lambda: self.client.get(url))
+
+    def test_follow_list(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('follow')
+        self.assertQueryBudget(lambda size: self.grow_users(min(size, 1000)), lambda: self.client.get(url),
+                               max_rows=1001)
+
+    def test_user_posts(self):
+        url = reverse('user_posts', args=(self.user2.pk,))
+        self.assertQueryBudget(self.grow_posts, lambda: self.client.get(url))
+
+    def test_search(self):
+        url = reverse('post_search')
+        self.assertQueryBudget(self.grow_posts, lambda: self.client.get(url, {'q': 'test title'}))
+
+    def test_feed(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_feed')
+        self.assertQueryBudget(self.grow_posts, *[lambda params=params: self.client.get(url, params)
+                                                  for params in ({}, {'readed': 'true'}, {'readed': 'false'},
+                                                                 {'pagination': 'cursor'})])
+
+    def test_feed_post(self):
+        self.client.force_authenticate(self.user)
+
+        def grow(size):
+            self.grow_posts(size)
+            self.url = reverse('post_read', args=(Post.objects.order_by('-id').values_list('id', flat=True)[0],))
+
+        self.assertQueryBudget(grow, lambda: self.client.get(self.url), lambda: self.client.get(self.url))
+
+    def test_feed_read(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_read')
+
+        def grow(size):
+            self.grow_posts(size)
+            self.data = json.dumps({'ids': list(Post.objects.order_by('-id').values_list('id', flat=True)[:50])})
+
+        self.assertQueryBudget(grow, lambda: self.client.post(url, data=self.data, content_type='application/json'))
+
+    def test_feed_unread(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('posts_unread')
+        self.assertQueryBudget(self.grow_posts, lambda: self.client.get(url))
+
+    def test_post_create(self):
+        self.client.force_authenticate(self.user2)
+        url = reverse('post_create')
+        data = json.dumps({'title': 'Test title', 'text': 'Test text'})
+        self.assertQueryBudget(self.grow_posts,
+                               lambda: self.client.post(url, data=data, content_type='application/json'))
+
+
+@tag('performance')
+class QueryPlanTestCase(APITestCase):
+    """
+    The list queries must use the indexes, not a scan and sort of the whole table.
+    """
+
+    def setUp(self):
+        self.user = UserModel.objects.create_user('john.doe@example.com', '123456super')
+        Post.objects.bulk_create([Post(title=f'Test title_{i}', text=f'Test text_{i}', owner=self.user)
+                                  for i in range(1000)])
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_user_posts(self):
+        queryset = Post.objects.filter(owner=self.user).order_by('-date_create', '-id')[:11]
+        self.assertUsesIndex(queryset, 'post_owner_date_id_idx')
+
+    def test_posts_version(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(1000, posts_version(self.user.pk)[1])
+        self.assertEqual(1, len(queries))
+        explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(explain + queries[0]['sql'])
+            plan = '\n'.join(' '.join(map(str, row)) for row in cursor.fetchall())
+        self.assertIn('post_owner_date_id_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertNotIn('COUNT(', queries[0]['sql'].upper())
+
+    def test_users_ordering(self):
+        queryset = UserModel.objects.order_by('-posts_count', '-id')[:10]
+        self.assertUsesIndex(queryset, 'user_posts_count_idx')
+
+    def test_feed_cursor(self):
+        """
+        A cursor page of the feed reads the keys of the page from the index of the "feed" field,
+        the not pushed posts from their index and the posts of the page by id, the feed is not sorted.
+        """
+        follower = UserModel.objects.create_user('jane.doe@example.com', '123456super')
+        UserFollowing.objects.create(user=follower, following_user=self.user)
+        feed = UserFeed.objects.create(user=follower)
+        FeedPost.objects.bulk_create([FeedPost(userfeed_id=feed.pk, post_id=pk, date_create=date)
+                                      for pk, date in Post.objects.values_list('pk', 'date_create')])
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.client.force_authenticate(follower)
+        response = self.client.get(reverse('posts_feed'), {'pagination': 'cursor'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(response.data['next'])
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        posts = Post.objects.order_by('-date_create', '-id').values_list('id', flat=True)[10:20]
+        self.assertEqual(list(posts), [post['id'] for post in response.data['results']])
+        explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        plans = {}
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if query['sql'].startswith('SELECT'):
+                    cursor.execute(explain + query['sql'])
+                    plans[query['sql']] = '\n'.join(' '.join(map(str, row)) for row in cursor.fetchall())
+        keys = [plan for sql, plan in plans.items() if f'FROM "{FeedPost._meta.db_table}"' in sql]
+        self.assertEqual(1, len(keys))
+        self.assertIn('feed_post_date_idx', keys[0])
+        self.assertNotIn('TEMP B-TREE', keys[0])
+        self.assertEqual(1, len([plan for plan in plans.values() if 'post_pull_idx' in plan]))
+        page = [plan for sql, plan in plans.items() if '"post_post"."title"' in sql]
+        self.assertEqual(1, len(page))
+        self.assertNotIn('TEMP B-TREE', page[0])
+        self.assertNotIn('SCAN post_post', page[0])
+
+    def test_search(self):
+        plan = search_posts(Post.objects.all(), 'test title').order_by('-rank', '-id')[:11].explain()
+        if connection.vendor == 'sqlite':
+            self.assertIn(f'SCAN {FTS_TABLE} VIRTUAL TABLE', plan)
+            self.assertNotIn('CORRELATED', plan)
+        else:
+            self.assertIn(PG_INDEX, plan)
+
+
+@tag('performance')
+class SerializerBenchmarkTestCase(APITestCase):
+    """
+    Compares the fast path of the lists (values() rows and PostValuesSerializer)
+    with PostSerializer over model instances, from the query to the rendered JSON.
+    The output must be the same, the timings are written to stderr.
+    """
+
+    def setUp(self):
+        self.user = UserModel.objects.create_user('john.doe@example.com', '123456super')
+        Post.objects.bulk_create([Post(title=f'Test title_{i}', text=f'Test text_{i}' * 20, owner=self.user)
+                                  for i in range(1000)])
+
+    def measure(self, render, repeat=5):
+        return min(timeit.repeat(render, number=1, repeat=repeat))
+
+    def test_values_serializer(self):
+        renderer = JSONRenderer()
+        queryset = Post.objects.order_by('-date_create', '-id')
+        values = PostValuesSerializer(PostValuesSerializer.compile(PostSerializer()))
+
+        def serializer():
+            return renderer.render(PostSerializer(queryset.select_related('owner'), many=True).data)
+
+        def fast():
+            values.instance = queryset.values(*values.columns)
+            return renderer.render(values.data)
+
+        self.assertEqual(serializer(), fast())
+        # The timings are only reported, an assertion on them would fail at random on a loaded machine.
+        slow_time, fast_time = self.measure(serializer), self.measure(fast)
+        sys.stderr.write(f'\nPostSerializer {slow_time * 1000:.1f} ms, PostValuesSerializer {fast_time * 1000:.1f} ms '
+                         f'per 1000 posts\n')
@@ -0,0 +1,190 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
+from uuid import UUID
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
+
+from blogAPI.renderers import FastJSONRenderer, emits_floats, has_floats, orjson
+from post.serializer import FeedReadSerializer, FeedUnreadSerializer, FollowingSerializer, PostSerializer, \
+    UserListSerializer
+
+DATA = [
+    {
+        'id': 1,
+        'title': 'Test title',
+        'text': 'Текст   line   paragraph "quoted" \\ \n\t émoji 😀',
+        'owner': {'id': 2, 'email': 'john.doe@example.com'},
+        'date_create': timezone.now(),
+        'archived': True,
+        'rank': None,
+    },
+    {
+        'naive': datetime(2022, 6, 1, 12, 30, 15, 123456),
+        'date': date(2022, 6, 1),
+        'delta': timedelta(minutes=5),
+        'decimal': Decimal('1.10'),
+        'uuid': UUID('12345678-1234-5678-1234-567812345678'),
+        'error': ErrorDetail('Invalid', code='invalid'),
+        'errors': {'title': [ErrorDetail('This field is required.', code='required')]},
+        1: 'int key',
+        'float': 0.1,
+        'big': 2 ** 60,
+        'tuple': (1, 2),
+    },
+    {'small': 1e-07, 'large': 1e+16, 'medium': 1e15, 'exponent': Decimal('1e-7'), 'negative': -2.5e-10},
+    {'id': 2 ** 64, 'negative': -2 ** 64 - 1, 'nested': [{'huge': 2 ** 70}]},
+    2 ** 64,
+    1e-07,
+    'string',
+    None,
+    [],
+    {},
+]
+
+
+class Numbers(serializers.Serializer):
+    id = serializers.IntegerField()
+    date = serializers.CharField(required=False)
+    price = serializers.DecimalField(max_digits=5, decimal_places=2, coerce_to_string=False, required=False)
+
+
+class Floats(serializers.Serializer):
+    id = serializers.IntegerField()
+    value = serializers.FloatField()
+
+
+class FastJSONRendererTestCase(SimpleTestCase):
+    """
+    The output must be the same as JSONRenderer's, with orjson and without it.
+    """
+
+    def setUp(self):
+        self.renderer = FastJSONRenderer()
+
+    def assertSameRender(self, data, accepted_media_type=None):
+        self.assertEqual(JSONRenderer().render(data, accepted_media_type),
+                         self.renderer.render(data, accepted_media_type))
+
+    def assertSameStream(self, items, accepted_media_type=None):
+        self.assertEqual(JSONRenderer().render(items, accepted_media_type),
+                         b''.join(self.renderer.stream(iter(items), accepted_media_type)))
+
+    def check_render(self):
+        for data in [DATA, *DATA, 1, 'string', True]:
+            with self.subTest(data=data):
+                self.assertSameRender(data)
+        self.assertSameRender(DATA, 'application/json; indent=4')
+        self.assertEqual(b'', self.renderer.render(None))
+        # Not JSON compliant floats are refused (STRICT_JSON).
+        for data in ([float('nan')], {'value': float('inf')}, [DATA[0], {'value': -float('inf')}]):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    JSONRenderer().render(data)
+                with self.assertRaises(ValueError):
+                    self.renderer.render(data)
+
+    def check_stream(self):
+        for size in (0, 1, 2, 3, 4, 7):
+            with self.subTest(size=size):
+                self.assertSameStream(DATA * size)
+        self.assertSameStream(DATA, 'application/json; indent=2')
+
+    @skipIf(orjson is None, 'orjson is not installed')
+    def test_render_orjson(self):
+        self.assertTrue(self.renderer.use_orjson())
+        self.check_render()
+
+    @mock.patch('blogAPI.renderers.orjson', None)
+    def test_render_fallback(self):
+        self.assertFalse(self.renderer.use_orjson())
+        self.check_render()
+
+    @skipIf(orjson is None, 'orjson is not installed')
+    def test_stream_orjson(self):
+        with mock.patch.object(FastJSONRenderer, 'stream_chunk_size', 3):
+            self.check_stream()
+
+    @mock.patch('blogAPI.renderers.orjson', None)
+    def test_stream_fallback(self):
+        with mock.patch.object(FastJSONRenderer, 'stream_chunk_size', 3):
+            self.check_stream()
+
+    def test_has_floats(self):
+        self.assertFalse(has_floats(DATA[0]))
+        self.assertFalse(has_floats([DATA[0], [None, 'string', 1, True], {}]))
+        self.assertTrue(has_floats([DATA[0], {'nested': [(1, 0.5)]}]))
+        self.assertTrue(has_floats({'value': Decimal('1')}))
+        self.assertTrue(has_floats(float('nan')))
+
+    def test_emits_floats(self):
+        for serializer in (UserListSerializer(), PostSerializer(many=True), FollowingSerializer(),
+                           FeedReadSerializer(), FeedUnreadSerializer(), Numbers()):
+            with self.subTest(serializer=serializer):
+                self.assertFalse(emits_floats(serializer))
+        self.assertTrue(emits_floats(Floats()))
+        self.assertTrue(emits_floats(Floats(many=True)))
+        self.assertTrue(emits_floats(serializers.ListField(child=serializers.FloatField())))
+        self.assertTrue(emits_floats(serializers.SerializerMethodField()))
+
+    @skipIf(orjson is None, 'orjson is not installed')
+    def test_float_fallback(self):
+        numbers = {'id': 1, 'date': '2022-06-01T12:30:15.123Z', 'price': Decimal('1.10')}
+        floats = {'id': 1, 'value': 0.5}
+        cases = [
+            # data, rendered by JSONRenderer, values looked into by has_floats()
+            (Numbers({'id': 1, 'date': '2022-06-01T12:30:15.123Z'}).data, False, 1),
+            ({'next': None, 'results': Numbers([{'id': 1}] * 10, many=True).data}, False, 2),
+            (Numbers(numbers).data, True, 1),
+            (Floats(floats).data, True, 2),
+            ({'results': Floats([floats], many=True).data}, True, 4),
+            ({'value': 0.5}, True, 2),
+            ({'value': Decimal('1.10')}, True, 2),
+        ]
+        render = JSONRenderer.render
+        for data, fallback, walked in cases:
+            with self.subTest(data=data):
+                with mock.patch.object(JSONRenderer, 'render', autospec=True, side_effect=render) as stock, \
+                        mock.patch('blogAPI.renderers.has_floats', wraps=has_floats) as walk:
+                    self.assertEqual(render(JSONRenderer(), data), self.renderer.render(data))
+                self.assertEqual(fallback, stock.called)
+                self.assertEqual(walked, walk.call_count)
+
+    @skipIf(orjson is None, 'orjson is not installed')
+    def test_stream_float_fallback(self):
+        floats = [{'id': 1, 'value': 0.5}, {'id': 2, 'value': 1e-07}]
+        for serializer, walked in ((Floats(), True), (Numbers(), False), (None, True)):
+            with self.subTest(serializer=serializer):
+                with mock.patch('blogAPI.renderers.has_floats', wraps=has_floats) as walk:
+                    chunks = b''.join(self.renderer.stream(iter(floats), serializer=serializer))
+                self.assertEqual(walked, walk.called)
+                if walked:
+                    self.assertEqual(JSONRenderer().render(floats), chunks)
+
+    def test_stream_chunks(self):
+        with mock.patch.object(FastJSONRenderer, 'stream_chunk_size', 2):
+            chunks = list(self.renderer.stream(iter(range(5))))
+        self.assertEqual([b'[0,1', b',2,3', b',4]'], chunks)
+
+    def test_stream_lazy(self):
+        def items():
+            yield 1
+            raise AssertionError('Read past the first chunk')
+
+        with mock.patch.object(FastJSONRenderer, 'stream_chunk_size', 1):
+            self.assertEqual(b'[1', next(self.renderer.stream(items())))
+
+    def test_not_compact(self):
+        class Stock(JSONRenderer):
+            compact = False
+
+        class Renderer(FastJSONRenderer):
+            compact = False
+
+        self.assertFalse(Renderer().use_orjson())
+        self.assertEqual(Stock().render(DATA), Renderer().render(DATA))
+        self.assertEqual(Stock().render(DATA), b''.join(Renderer().stream(iter(DATA))))
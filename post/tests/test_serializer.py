@@ -1,9 +1,11 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Count
+from django.db.models.functions import Substr
 from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
 
 from post.models import Post, UserFollowing
-from post.serializer import PostOwnerSerializer, PostSerializer, FollowingSerializer, UserListSerializer
+from post.serializer import PostOwnerSerializer, PostSerializer, FollowingSerializer, UserListSerializer, \
+    FeedReadSerializer, PostValuesSerializer
 
 UserModel = get_user_model()
 
@@ -78,6 +80,31 @@ class PostSerializerTestCase(TestCase):
         self.assertEqual(expected_data, data)
 
 
+class PostValuesSerializerTestCase(TestCase):
+    def setUp(self):
+        self.user = UserModel.objects.create_user('john.doe@example.com', '123456super')
+        self.user.posts.create(title='Test title', text='Test text "ünicode"\n')
+        self.user.posts.create(title='', text='x' * 1000)
+
+    def assertSameJSON(self, queryset, **kwargs):
+        values = PostValuesSerializer(PostValuesSerializer.compile(PostSerializer(**kwargs)))
+        values.instance = queryset.order_by('-id').values(*values.columns)
+        posts = queryset.order_by('-id').select_related('owner')
+        self.assertEqual(JSONRenderer().render(PostSerializer(posts, many=True, **kwargs).data),
+                         JSONRenderer().render(values.data))
+
+    def test_same_output(self):
+        self.assertSameJSON(Post.objects.all())
+        self.assertSameJSON(Post.objects.all(), fields=('title', 'owner'))
+        self.assertSameJSON(Post.objects.annotate(text_excerpt=Substr('text', 1, 5)), excerpt=True)
+
+    def test_columns(self):
+        plan = PostValuesSerializer.compile(PostSerializer(fields=('id', 'owner'), excerpt=True))
+        self.assertEqual(['id', 'owner__id', 'owner__email'], PostValuesSerializer(plan).columns)
+        plan = PostValuesSerializer.compile(PostSerializer(excerpt=True))
+        self.assertIn('text_excerpt', PostValuesSerializer(plan).columns)
+
+
 class FollowingSerializerTestCase(TestCase):
     def setUp(self):
         self.email = 'john.doe@example.com'
@@ -137,19 +164,38 @@ class UserListSerializerTestCase(TestCase):
         )
 
     def test_UserList_ok(self):
-        users = UserModel.objects.all().annotate(
-            posts_count=Count('posts')
-        )
+        users = UserModel.objects.all()
         data = UserListSerializer(users, many=True).data
         expected_data = [
             {
                 'id': self.user.id,
                 'email': 'john.doe@example.com',
-                'posts_count': 3
+                'posts_count': 3,
+                'followers_count': 0,
+                'following_count': 0
             },
             {'id': self.user2.id,
              'email': 'jane.doe@example.com',
-             'posts_count': 5
+             'posts_count': 5,
+             'followers_count': 0,
+             'following_count': 0
              },
         ]
         self.assertEqual(expected_data, data)
+
+
+class FeedReadSerializerTestCase(TestCase):
+    def test_ids_ok(self):
+        serializer = FeedReadSerializer(data={'ids': [1, 2]})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual({'ids': [1, 2]}, serializer.validated_data)
+
+    def test_until_ok(self):
+        serializer = FeedReadSerializer(data={'until': '2022-06-24T10:00:00Z'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual('2022-06-24T10:00:00Z', FeedReadSerializer(serializer.validated_data).data['until'])
+
+    def test_invalid(self):
+        self.assertFalse(FeedReadSerializer(data={}).is_valid())
+        self.assertFalse(FeedReadSerializer(data={'ids': [1], 'until': '2022-06-24T10:00:00Z'}).is_valid())
+        self.assertFalse(FeedReadSerializer(data={'ids': list(range(101))}).is_valid())
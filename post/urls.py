@@ -1,14 +1,21 @@
 from django.urls import path
 
 from .views import PostCreateAPIView, PostListAPIView, FollowListCreateAPIView, PostsFeedListAPIView, \
-    PostFeedRetrieveAPIView, UnfollowAPIView, UsersListAPIView
+    PostFeedRetrieveAPIView, UnfollowAPIView, UsersListAPIView, PostsFeedReadAPIView, PostsFeedUnreadAPIView, \
+    UserProfileAPIView, PostSearchAPIView, PostBulkCreateAPIView, PostExportAPIView
 
 urlpatterns = [
     path(r'users/', UsersListAPIView.as_view(), name='users_list'),
+    path(r'users/<int:pk>/', UserProfileAPIView.as_view(), name='user_profile'),
     path(r'posts/<int:pk>/', PostListAPIView.as_view(), name='user_posts'),
+    path(r'posts/<int:pk>/export/', PostExportAPIView.as_view(), name='user_posts_export'),
     path(r'create/', PostCreateAPIView.as_view(), name='post_create'),
+    path(r'create/bulk/', PostBulkCreateAPIView.as_view(), name='post_bulk_create'),
+    path(r'search/', PostSearchAPIView.as_view(), name='post_search'),
     path(r'follow/', FollowListCreateAPIView.as_view(), name='follow'),
     path(r'unfollow/<int:following_user>/', UnfollowAPIView.as_view(), name='unfollow'),
     path(r'feed/', PostsFeedListAPIView.as_view(), name='posts_feed'),
     path(r'feed/<int:pk>/', PostFeedRetrieveAPIView.as_view(), name='post_read'),
+    path(r'feed/read/', PostsFeedReadAPIView.as_view(), name='posts_read'),
+    path(r'feed/unread/', PostsFeedUnreadAPIView.as_view(), name='posts_unread'),
 ]
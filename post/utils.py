@@ -1,30 +1,497 @@
-from post.models import Post, UserFeed
+import math
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
 
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef, Q, Max, Subquery, ExpressionWrapper, BooleanField, F, Count, \
+    Value, TextField
+from django.db.models.functions import Coalesce, Cast, Length
+from django.utils import timezone
 
-def feed_create_or_add(self):
+from post.cache import feed_cache_pulled_changed
+from post.fields import COMPRESSED_PREFIX, compress, compress_size, stores_compressed
+from post.models import Post, UserFeed, UserFollowing, FeedJob, FeedPost, ArchivedPost, ArchivedFeedPost, \
+    ArchivedReadPost
+
+UserModel = get_user_model()
+
+USER_COUNTERS = ('posts_count', 'followers_count', 'following_count')
+
+
+def feed_sync(obj, since):
     """
-    Creates or updates a user's post feed.
-    Adds 'following_user' posts created after 'date_update'.
-    Once added, updates the 'date_update' field.
+    Adds the posts of followed users created after 'since' that are missing from the "feed" field,
+    for example posts that were not delivered when they were created.
+    The new version of the feed is read back into 'obj', it is part of the keys of the cached pages.
     """
-    user = self.request.user
-    obj, created = UserFeed.objects.get_or_create(user=user)
-    following_id = user.following.values_list('following_user', flat=True)
-    posts = Post.objects.filter(owner__in=following_id,
-                                date_create__gte=obj.date_update).values_list('pk', flat=True)
-    obj.feed.add(*posts)
-    obj.save()
+    following_id = UserFollowing.objects.filter(user_id=obj.pk).values('following_user')
+    posts = Post.objects.filter(owner__in=following_id, fan_out=True,
+                                date_create__gte=since). \
+        exclude(id__in=obj.feed.values('id')).values_list('pk', 'date_create')
+    posts = dict(posts)
+    if posts:
+        FeedPost.objects.bulk_create([FeedPost(userfeed_id=obj.pk, post_id=pk, date_create=date)
+                                      for pk, date in posts.items()])
+        unread = feed_unread_pushed(obj).filter(id__in=posts).count()
+        UserFeed.objects.filter(pk=obj.pk).update(unread_count=F('unread_count') + unread,
+                                                  version=F('version') + 1)
+        obj.refresh_from_db(fields=['unread_count', 'version'])
+
+
+def feed_refresh(obj):
+    """
+    Syncs the feed if it was last updated more than FEED_REFRESH_INTERVAL ago, otherwise does nothing.
+    'date_update' is moved only if it has not changed since the feed was read,
+    so a feed is refreshed by one request at a time and the others skip the refresh.
+    """
+    interval = settings.FEED_REFRESH_INTERVAL
+    if interval is None:
+        return
+    now = timezone.now()
+    if obj.date_update > now - interval:
+        return
+    with transaction.atomic():
+        if not UserFeed.objects.filter(pk=obj.pk, date_update=obj.date_update).update(date_update=now):
+            return
+        feed_sync(obj, obj.date_update)
+    obj.date_update = now
 
 
 def feed_delete(self):
     """
-    When unsubscribing from a user, removes his posts from the "feed" and "read" fields of the feed.
+    When unsubscribing from a user, queues the removal of his posts from the "feed" and "read" fields
+    of the feed (see feed_purge) and decrements 'unread_count' by his unread posts.
+    The posts are hidden from the feed as soon as the subscription is deleted.
     Does NOT update the "date update" field.
     """
     user = self.request.user
     following_user = self.kwargs.get('following_user')
-    obj = UserFeed.objects.get(user=user)
-    unfollow_post_feed = obj.feed.filter(owner_id=following_user).values_list('id', flat=True)
-    unfollow_post_read = obj.read.filter(owner_id=following_user).values_list('id', flat=True)
-    obj.feed.remove(*unfollow_post_feed)
-    obj.read.remove(*unfollow_post_read)
+    obj = UserFeed.objects.filter(user=user).first()
+    if obj is None:
+        return
+    unread = feed_unread_pushed_total(obj, owner_id=following_user)
+    UserFeed.objects.filter(pk=obj.pk).update(unread_count=F('unread_count') - unread,
+                                              version=F('version') + 1)
+    FeedJob.objects.create(action=FeedJob.PURGE, user=user, author_id=following_user)
+
+
+def feed_follow(user_id, author_id):
+    """
+    Called after subscribing to a user. Cancels the queued removal of his posts from the feed
+    and adds his latest FEED_FOLLOW_BACKFILL posts to the "feed" field in one bulk insert,
+    posts that are already there are skipped. The cost does not depend on the number of his posts.
+    His unread posts in the "feed" field are counted in 'unread_count' again.
+    """
+    FeedJob.objects.filter(action=FeedJob.PURGE, user_id=user_id, author_id=author_id).delete()
+    obj = UserFeed.objects.filter(pk=user_id).first()
+    if obj is None:
+        return
+    if settings.FEED_FOLLOW_BACKFILL:
+        posts = Post.objects.filter(owner_id=author_id). \
+            values_list('pk', 'date_create')[:settings.FEED_FOLLOW_BACKFILL]
+        FeedPost.objects.bulk_create([FeedPost(userfeed_id=obj.pk, post_id=pk, date_create=date) for pk, date in posts],
+                                     ignore_conflicts=True)
+    unread = feed_unread_pushed_total(obj, owner_id=author_id)
+    UserFeed.objects.filter(pk=obj.pk).update(unread_count=F('unread_count') + unread,
+                                              version=F('version') + 1)
+
+
+def feed_purge(user_id, author_id, batch_size):
+    """
+    Removes the posts of the unfollowed user from the "feed" and "read" fields of the feed and from their
+    archived rows, 'batch_size' posts per transaction. Stops if the user is followed again.
+    """
+    throughs = [through.objects.filter(userfeed_id=user_id, post__owner_id=author_id)
+                for through in (FeedPost, UserFeed.read.through, ArchivedFeedPost, ArchivedReadPost)]
+    for through in throughs:
+        while True:
+            with transaction.atomic():
+                if UserFollowing.objects.filter(user_id=user_id, following_user_id=author_id).exists():
+                    return
+                ids = list(through.values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                through.model.objects.filter(id__in=ids).delete()
+
+
+def feed_sources(archive=False):
+    """
+    Returns the post model and the models of the rows of the "feed" and "read" fields:
+    of the post table, or of the archive if 'archive' is True.
+    """
+    if archive:
+        return ArchivedPost, ArchivedFeedPost, ArchivedReadPost
+    return Post, FeedPost, UserFeed.read.through
+
+
+def feed_archives():
+    """
+    Returns the values of the 'archive' argument of the feed functions covering the whole feed:
+    the post table, and the archive if it is turned on.
+    """
+    return (False, True) if settings.POST_ARCHIVE_AGE is not None else (False,)
+
+
+def feed_posts(obj, archive=False):
+    """
+    Returns the posts of the user's feed, newest first, the archived ones if 'archive' is True.
+    Posts from the "feed" field are merged with the not pushed posts ('fan_out' = False)
+    of followed users created after the moment of subscription.
+    Posts of unfollowed users are hidden until they are removed from the "feed" field.
+    The query reads only the rows of the feed, but it sorts them on every page: the cost of a page
+    grows with the size of the feed. The cursor pages are read by feed_keys() instead.
+    """
+    model, feed, read = feed_sources(archive)
+    pushed = feed.objects.filter(userfeed_id=obj.pk).values('post_id')
+    following_id = UserFollowing.objects.filter(user_id=obj.pk).values('following_user')
+    return model.objects.filter(Q(id__in=pushed, owner__in=following_id) | feed_pulled(obj.pk))
+
+
+def feed_keys(obj, readed=None):
+    """
+    Returns the keys ('date_create', post id) of the posts of the user's feed (see feed_posts) in two querysets,
+    both in the order of their index: the rows of the "feed" field (FeedPost) and the not pushed posts.
+    'readed' True or False keeps only the read or the unread posts.
+    A page of the feed is the merge of the pages of both, so it is read from the index of the feed
+    without sorting the feed, the not pushed posts are sorted (there are few of them).
+    """
+    following_id = UserFollowing.objects.filter(user_id=obj.pk).values('following_user')
+    pushed = FeedPost.objects.filter(userfeed_id=obj.pk, post__owner__in=following_id)
+    pulled = Post.objects.filter(feed_pulled(obj.pk))
+    return (feed_filter_read(pushed, obj, readed, post='post_id').values_list('date_create', 'post_id'),
+            feed_filter_read(pulled, obj, readed).values_list('date_create', 'id'))
+
+
+def feed_pulled(user_id):
+    """
+    Returns the condition for the not pushed posts ('fan_out' = False) of the user's feed.
+    """
+    following_id = UserFollowing.objects.filter(user_id=user_id).values('following_user')
+    followed_before = UserFollowing.objects.filter(user_id=user_id, following_user=OuterRef('owner'),
+                                                   created__lte=OuterRef('date_create'))
+    return Q(Exists(followed_before), fan_out=False, owner__in=following_id)
+
+
+def feed_filter_read(queryset, obj, readed, archive=False, post='id'):
+    """
+    Keeps the read posts of the user's feed if 'readed' is True, the unread ones if it is False,
+    all of them if it is None. The queryset is of posts or of rows of posts ('post' names the post id field).
+    The read posts are the posts created before or at 'read_until' and the posts from the "read" field.
+    """
+    if readed is None:
+        return queryset
+    read = Q(**{f'{post}__in': feed_sources(archive)[2].objects.filter(userfeed_id=obj.pk).values('post_id')})
+    if readed:
+        if obj.read_until is not None:
+            read |= Q(date_create__lte=obj.read_until)
+        return queryset.filter(read)
+    if obj.read_until is not None:
+        queryset = queryset.filter(date_create__gt=obj.read_until)
+    return queryset.exclude(read)
+
+
+def feed_read_posts(obj, archive=False):
+    """
+    Returns the read posts of the user's feed (see feed_posts and feed_filter_read).
+    """
+    return feed_filter_read(feed_posts(obj, archive), obj, True, archive)
+
+
+def feed_unread_posts(obj, archive=False):
+    """
+    Returns the unread posts of the user's feed (see feed_posts and feed_filter_read).
+    """
+    return feed_filter_read(feed_posts(obj, archive), obj, False, archive)
+
+
+def feed_unread_pushed(obj, archive=False):
+    """
+    Returns the unread posts of the "feed" field, or of its archived rows if 'archive' is True,
+    these posts are counted by 'unread_count'.
+    """
+    model, feed, read = feed_sources(archive)
+    following_id = UserFollowing.objects.filter(user_id=obj.pk).values('following_user')
+    queryset = model.objects.filter(id__in=feed.objects.filter(userfeed_id=obj.pk).values('post_id'),
+                                    owner__in=following_id)
+    if obj.read_until is not None:
+        queryset = queryset.filter(date_create__gt=obj.read_until)
+    return queryset.exclude(id__in=read.objects.filter(userfeed_id=obj.pk).values('post_id'))
+
+
+def feed_unread_pushed_total(obj, **filters):
+    """
+    Returns the number of the unread posts of the "feed" field and of its archived rows matching the filters.
+    """
+    return sum(feed_unread_pushed(obj, archive).filter(**filters).count() for archive in feed_archives())
+
+
+def feed_unread_pushed_count():
+    """
+    Returns the subquery of the number of unread posts in the "feed" field of the feed from the outer query
+    and in its archived rows, the value of 'unread_count' (see feed_unread_pushed).
+    """
+    followed = UserFollowing.objects.filter(user_id=OuterRef('userfeed_id'),
+                                            following_user_id=OuterRef('post__owner'))
+    read_until = Coalesce(OuterRef('read_until'), Value(datetime.min.replace(tzinfo=dt_timezone.utc)))
+    total = Value(0)
+    for archive in feed_archives():
+        model, feed, read = feed_sources(archive)
+        read = read.objects.filter(userfeed_id=OuterRef('userfeed_id'), post_id=OuterRef('post_id'))
+        unread = feed.objects.filter(Exists(followed), userfeed_id=OuterRef('pk'), post__date_create__gt=read_until). \
+            exclude(Exists(read)).order_by().values('userfeed_id').annotate(count=Count('id')).values('count')
+        total = total + Coalesce(Subquery(unread), 0)
+    return total
+
+
+def feed_get_post(user_id, pk, archive=False):
+    """
+    Returns the post of the user's feed with the 'is_read' flag, or None if it is not in the feed.
+    With 'archive' the post is looked for in the archive.
+    Makes a single query that does not depend on the size of the feed.
+    """
+    obj = UserFeed(pk=user_id)
+    read_until = UserFeed.objects.filter(pk=user_id).values('read_until')
+    read = feed_sources(archive)[2].objects.filter(userfeed_id=user_id, post_id=OuterRef('pk'))
+    is_read = ExpressionWrapper(Q(Exists(read)) | Q(date_create__lte=Subquery(read_until)),
+                                output_field=BooleanField())
+    return feed_posts(obj, archive).filter(pk=pk).select_related('owner').annotate(is_read=is_read).first()
+
+
+def feed_mark_read(user_id, post_ids, archive=False):
+    """
+    Adds unread posts to the "read" field of the user's feed, posts that are already there are skipped.
+    Decrements 'unread_count' by the number of the added posts it counts (see feed_unread_pushed).
+    The feed row is locked, so concurrent calls with the same posts decrement the counter once.
+    With 'archive' the posts are archived ones, their archived rows are used.
+    """
+    if not post_ids:
+        return
+    model, feed, through = feed_sources(archive)
+    with transaction.atomic():
+        obj = UserFeed.objects.select_for_update().filter(pk=user_id).only('read_until').first()
+        if obj is None:
+            return
+        # Counted while the row is locked, before the posts are added: the posts read by a concurrent call
+        # are already in the "read" field and are not counted again.
+        unread = feed_unread_pushed(obj, archive).filter(id__in=post_ids).count()
+        through.objects.bulk_create([through(userfeed_id=user_id, post_id=pk) for pk in post_ids],
+                                    ignore_conflicts=True)
+        UserFeed.objects.filter(pk=user_id).update(unread_count=F('unread_count') - unread,
+                                                   version=F('version') + 1)
+
+
+def feed_compact_read(obj):
+    """
+    Moves 'read_until' up to the oldest unread post of the feed, archived posts included,
+    and removes the posts that are now covered by it from the "read" field.
+    """
+    oldest_unread = [feed_unread_posts(obj, archive).order_by('date_create').
+                     values_list('date_create', flat=True).first() for archive in feed_archives()]
+    oldest_unread = min(filter(None, oldest_unread), default=None)
+    read_until = []
+    for archive in feed_archives():
+        read = feed_posts(obj, archive)
+        if oldest_unread is not None:
+            read = read.filter(date_create__lt=oldest_unread)
+        read_until.append(read.aggregate(date=Max('date_create'))['date'])
+    read_until = max(filter(None, read_until), default=None)
+    if read_until is not None:
+        feed_mark_read_until(obj, read_until)
+
+
+def feed_mark_read_until(obj, read_until):
+    """
+    Marks all posts of the feed created before or at 'read_until' as read.
+    The mark never moves back or into the future.
+    """
+    read_until = min(read_until, timezone.now())
+    if obj.read_until is not None and read_until <= obj.read_until:
+        return
+    unread = feed_unread_pushed_total(obj, date_create__lte=read_until)
+    UserFeed.objects.filter(pk=obj.pk).update(read_until=read_until,
+                                              unread_count=F('unread_count') - unread,
+                                              version=F('version') + 1)
+    obj.read_until = read_until
+    for archive in feed_archives():
+        feed_sources(archive)[2].objects.filter(userfeed_id=obj.pk, post__date_create__lte=read_until).delete()
+
+
+def feed_fan_out(posts):
+    """
+    Delivers new posts to the feeds of their owners' followers.
+    Rows are inserted into the "feed" field in batches of FEED_FAN_OUT_BATCH_SIZE,
+    posts that are already in the feed are skipped.
+    Posts of users with at least FEED_FAN_OUT_THRESHOLD followers are not delivered,
+    they are marked with 'fan_out' = False and merged into the feed when it is read.
+    """
+    threshold = settings.FEED_FAN_OUT_THRESHOLD
+    owners, dates = {}, {}
+    for post in posts:
+        owners.setdefault(post.owner_id, []).append(post.pk)
+        dates[post.pk] = post.date_create
+    for owner_id, post_ids in owners.items():
+        if threshold is not None and \
+                UserModel.objects.filter(pk=owner_id, followers_count__gte=threshold).exists():
+            Post.objects.filter(pk__in=post_ids).update(fan_out=False)
+            feed_cache_pulled_changed()
+            for post in posts:
+                if post.owner_id == owner_id:
+                    post.fan_out = False
+            continue
+        feed_ids = UserFeed.objects.filter(user__following__following_user=owner_id). \
+            values_list('pk', flat=True).iterator()
+        feeds_per_batch = max(settings.FEED_FAN_OUT_BATCH_SIZE // len(post_ids), 1)
+        while True:
+            batch = list(islice(feed_ids, feeds_per_batch))
+            if not batch:
+                break
+            FeedPost.objects.bulk_create([FeedPost(userfeed_id=feed_id, post_id=post_id, date_create=dates[post_id])
+                                          for feed_id in batch for post_id in post_ids],
+                                         ignore_conflicts=True)
+            UserFeed.objects.filter(pk__in=batch).update(unread_count=F('unread_count') + len(post_ids),
+                                                         version=F('version') + 1)
+
+
+def feed_unread_total(user_id):
+    """
+    Returns the number of unread posts in the user's feed.
+    Reads 'unread_count' by the primary key in a single query. If FEED_FAN_OUT_THRESHOLD is set,
+    the unread not pushed posts ('fan_out' = False), archived ones included, are counted by subqueries
+    of the same query.
+    """
+    total = F('unread_count')
+    if settings.FEED_FAN_OUT_THRESHOLD is not None:
+        read_until = Coalesce(OuterRef('read_until'), Value(datetime.min.replace(tzinfo=dt_timezone.utc)))
+        for archive in feed_archives():
+            model, feed, read = feed_sources(archive)
+            read = read.objects.filter(userfeed_id=user_id).values('post_id')
+            pulled = model.objects.filter(feed_pulled(user_id), date_create__gt=read_until). \
+                exclude(id__in=read).order_by().values('fan_out').annotate(count=Count('id')).values('count')
+            total = total + Coalesce(Subquery(pulled), 0)
+    count = UserFeed.objects.filter(pk=user_id).annotate(total=total).values_list('total', flat=True).first()
+    return count or 0
+
+
+def feed_rebuild_unread_count(obj, save=True):
+    """
+    Recounts 'unread_count' of the feed from the "feed" and "read" fields and their archived rows.
+    Returns the stored and the actual value, the actual one is saved if 'save' is True.
+    """
+    stored = obj.unread_count
+    count = feed_unread_pushed_total(obj)
+    if save and count != stored:
+        UserFeed.objects.filter(pk=obj.pk).update(unread_count=count)
+        obj.unread_count = count
+    return stored, count
+
+
+def posts_version(owner_id):
+    """
+    Returns the version marker of the user's posts: the date of his latest post, his 'posts_count'
+    and 'posts_edits', or None if he has no posts. Makes a single query,
+    the latest date is read from the index of his posts.
+    """
+    latest = Post.objects.filter(owner_id=OuterRef('pk')).order_by('-date_create', '-id').values('date_create')[:1]
+    version = UserModel.objects.filter(pk=owner_id). \
+        values('posts_count', 'posts_edits', latest=Subquery(latest)).first()
+    if version is None or version['latest'] is None:
+        return None
+    return version['latest'].isoformat(), version['posts_count'], version['posts_edits']
+
+
+def posts_compress_texts(batch_size=1000):
+    """
+    Rewrites the stored texts of the posts to match settings.POST_TEXT_COMPRESS_SIZE:
+    compresses the long plain texts, or decompresses the texts when the compression is off.
+    Goes through the posts by id in batches, returns the number of rewritten posts.
+    Does nothing on the databases storing the texts as is.
+    """
+    connection = connections[Post.objects.db]
+    if not stores_compressed(connection):
+        return 0
+    size = compress_size(connection)
+    candidates = Q(text__startswith=COMPRESSED_PREFIX)
+    if size is not math.inf:
+        candidates |= Q(length__gt=size)
+    # 'stored' is the raw column, 'text' is decompressed when read.
+    queryset = Post.objects.annotate(length=Length('text'), stored=Cast('text', TextField())). \
+        filter(candidates).only('id', 'text').order_by('id')
+    count, last = 0, 0
+    while True:
+        posts = list(queryset.filter(id__gt=last)[:batch_size])
+        if not posts:
+            return count
+        last = posts[-1].id
+        changed = [post for post in posts if compress(post.text, size) != post.stored]
+        Post.objects.bulk_update(changed, ['text'])
+        count += len(changed)
+
+
+def posts_archive(cutoff, batch_size=1000):
+    """
+    Moves the posts created before 'cutoff' into the archive, 'batch_size' posts per transaction.
+    Their rows of the "feed" and "read" fields of the feeds are moved to the archived rows,
+    so the read state of the feeds and 'unread_count' do not change. The owners' 'posts_count' does not change.
+    Returns the number of moved posts.
+    """
+    columns = ', '.join(field.column for field in ArchivedPost._meta.concrete_fields)
+    rows = [(FeedPost, ArchivedFeedPost), (UserFeed.read.through, ArchivedReadPost)]
+    count = 0
+    while True:
+        with transaction.atomic():
+            ids = list(Post.objects.filter(date_create__lt=cutoff).order_by('date_create', 'id').
+                       values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            placeholders = ', '.join(['%s'] * len(ids))
+            with connections[Post.objects.db].cursor() as cursor:
+                cursor.execute(f'INSERT INTO {ArchivedPost._meta.db_table} ({columns}) '
+                               f'SELECT {columns} FROM {Post._meta.db_table} WHERE id IN ({placeholders})', ids)
+                for source, target in rows:
+                    cursor.execute(f'INSERT INTO {target._meta.db_table} (userfeed_id, post_id) '
+                                   f'SELECT userfeed_id, post_id FROM {source._meta.db_table} '
+                                   f'WHERE post_id IN ({placeholders})', ids)
+            Post.objects.filter(id__in=ids).delete_archived()
+        count += len(ids)
+    if count:
+        feed_cache_pulled_changed()
+    return count
+
+
+def user_counter_actual(field):
+    """
+    Returns the subquery of the actual value of the counter 'field' of the user from the outer query.
+    """
+    sources = {
+        'posts_count': [(Post, 'owner'), (ArchivedPost, 'owner')],
+        'followers_count': [(UserFollowing, 'following_user')],
+        'following_count': [(UserFollowing, 'user')],
+    }[field]
+    actual = Value(0)
+    for model, user_field in sources:
+        count = model.objects.filter(**{user_field: OuterRef('pk')}).order_by().values(user_field). \
+            annotate(count=Count('id')).values('count')
+        actual = actual + Coalesce(Subquery(count), 0)
+    return actual
+
+
+def user_counters_drift():
+    """
+    Returns the users with a counter that differs from the actual value,
+    annotated with the actual values as 'actual_<counter>'.
+    """
+    drift = Q()
+    for field in USER_COUNTERS:
+        drift |= ~Q(**{field: F(f'actual_{field}')})
+    return UserModel.objects.annotate(**{f'actual_{field}': user_counter_actual(field)
+                                         for field in USER_COUNTERS}).filter(drift)
+
+
+def user_counters_reconcile(user_ids):
+    """
+    Sets the counters of the users to their actual values in one query.
+    """
+    UserModel.objects.filter(pk__in=user_ids).update(**{field: user_counter_actual(field)
+                                                        for field in USER_COUNTERS})
@@ -1,31 +1,167 @@
+import json
+from itertools import chain, islice
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
-from django.db.models import Count
+from django.db import IntegrityError, transaction
+from django.db.models import Value
+from django.db.models.functions import Substr
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
 from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiParameter, OpenApiExample
 from rest_framework import generics, mixins
 from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.filters import OrderingFilter
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 
-from post.models import Post, UserFollowing, UserFeed
-from post.serializer import PostSerializer, FollowingSerializer, UserListSerializer
-from post.utils import feed_create_or_add, feed_delete
+from post.cache import feed_cache_key, feed_cache_get, feed_cache_pulled, feed_cache_set, make_etag
+from post.fields import Decompress
+from post.models import Post, UserFollowing, UserFeed, ArchivedPost
+from post.pagination import PostsCursorPagination, FeedCursorPagination, SearchCursorPagination, ArchiveChain
+from post.search import search_posts
+from post.serializer import PostSerializer, FollowingSerializer, UserListSerializer, FeedReadSerializer, \
+    FeedUnreadSerializer, PostValuesSerializer
+from post.utils import feed_delete, feed_follow, feed_fan_out, feed_posts, feed_read_posts, \
+    feed_unread_posts, feed_get_post, feed_mark_read, feed_mark_read_until, feed_unread_total, feed_refresh, \
+    posts_version, feed_archives, feed_keys
 
 UserModel = get_user_model()
 
 
+POST_FIELDS_PARAMETERS = [
+    OpenApiParameter(name='fields',
+                     description='Comma-separated fields of the posts to display, for example "id,title"',
+                     required=False,
+                     type=str,
+                     ),
+    OpenApiParameter(name='excerpt',
+                     description='Display only the first N characters of the text of the posts',
+                     required=False,
+                     type=int,
+                     ),
+]
+
+
+class PostFieldsMixin:
+    """
+    Sparse fieldsets of the post lists.
+    ?fields=id,title displays only these fields of the posts,
+    ?excerpt=N displays only the first N characters of the text.
+    The posts are fetched as values() rows of the displayed fields and serialized
+    by PostValuesSerializer, the excerpt is cut by the database.
+    """
+    post_fields = ('id', 'title', 'text', 'owner', 'date_create')
+    max_excerpt = 10000
+
+    def get_post_fields(self):
+        if not hasattr(self, '_post_fields'):
+            fields = self.request.query_params.get('fields') if self.request else None
+            excerpt = self.request.query_params.get('excerpt') if self.request else None
+            if fields is not None:
+                fields = tuple(field for field in fields.split(',') if field)
+                unknown = set(fields) - set(self.post_fields)
+                if unknown or not fields:
+                    raise ValidationError({'error': f'Unknown fields: {", ".join(sorted(unknown))}'
+                                           if unknown else 'Pass at least one field'})
+            if excerpt is not None:
+                try:
+                    excerpt = int(excerpt)
+                except ValueError:
+                    excerpt = 0
+                if not 0 < excerpt <= self.max_excerpt:
+                    raise ValidationError({'error': f'"excerpt" must be from 1 to {self.max_excerpt}'})
+            self._post_fields = fields, excerpt
+        return self._post_fields
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if queryset is None:
+            return queryset
+        fields, excerpt = self.get_post_fields()
+        if excerpt is not None and 'text' in (fields or self.post_fields):
+            queryset = queryset.annotate(text_excerpt=Substr(Decompress('text'), 1, excerpt))
+        # The pagination keys are always read.
+        columns = ['id', 'date_create', *(order.lstrip('-') for order in getattr(self.paginator, 'ordering', ()))]
+        expressions = {'archived': Value(True)} if queryset.model is ArchivedPost else {}
+        return queryset.values(*dict.fromkeys(columns + self.get_values_serializer().columns), **expressions)
+
+    def get_serializer(self, *args, **kwargs):
+        fields, excerpt = self.get_post_fields()
+        kwargs.setdefault('fields', fields)
+        kwargs.setdefault('excerpt', excerpt is not None)
+        if kwargs.get('many'):
+            return self.get_values_serializer(*args)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_values_serializer(self, instance=None):
+        """
+        The posts are listed by the fast path serializer, their rows are fetched by values().
+        """
+        if not hasattr(self, '_values_plan'):
+            serializer = self.get_serializer()
+            self._values_plan = PostValuesSerializer.compile(serializer), serializer
+        plan, serializer = self._values_plan
+        return PostValuesSerializer(plan, instance, serializer)
+
+
+class StreamingListMixin:
+    """
+    Streams the not paginated lists longer than STREAMING_LIST_THRESHOLD items if the renderer can stream
+    (FastJSONRenderer): the items are read from the database and rendered chunk by chunk as the response is sent,
+    so the memory used does not depend on the length of the list. Shorter lists are rendered as usual.
+    """
+
+    def list(self, request, *args, **kwargs):
+        renderer = getattr(request, 'accepted_renderer', None)
+        if self.paginator is not None or not hasattr(renderer, 'stream'):
+            return super().list(request, *args, **kwargs)
+        objs = self.filter_queryset(self.get_queryset()).iterator()
+        head = list(islice(objs, settings.STREAMING_LIST_THRESHOLD + 1))
+        if len(head) <= settings.STREAMING_LIST_THRESHOLD:
+            return Response(self.get_serializer(head, many=True).data)
+        serializer = self.get_serializer()
+        items = (serializer.to_representation(obj) for obj in chain(head, objs))
+        context = self.get_renderer_context()
+        return StreamingHttpResponse(renderer.stream(items, request.accepted_media_type, context, serializer),
+                                     content_type=renderer.media_type)
+
+
+class UsersOrderingFilter(OrderingFilter):
+    """
+    Adds the user id to the ordering in the same direction, so that the pages do not overlap
+    and sorting by the number of posts is an index scan.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view) or ()
+        direction = '-' if ordering and ordering[-1].startswith('-') else ''
+        return (*ordering, direction + 'id')
+
+
+class UsersListAPIListPagination(PageNumberPagination):
+    """
+    Page pagination. The default is 10 users per page.
+    You can change the number of users by passing the 'page_size' parameter.
+    Max value = 100 users per page.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
 class UsersListAPIView(mixins.ListModelMixin, generics.GenericAPIView):
     """
-    View the list of users and the number of their posts.
+    View the list of users and the number of their posts, followers and subscriptions.
     """
-    queryset = UserModel.objects.all().only('id', 'email').annotate(
-        posts_count=Count('posts')
-    )
+    queryset = UserModel.objects.all().only('id', 'email', 'posts_count', 'followers_count', 'following_count')
     serializer_class = UserListSerializer
     permission_classes = [AllowAny]
-    filter_backends = (OrderingFilter,)
+    pagination_class = UsersListAPIListPagination
+    filter_backends = (UsersOrderingFilter,)
     ordering_fields = ('posts_count',)
 
     @extend_schema(
@@ -58,42 +194,189 @@ class UsersListAPIView(mixins.ListModelMixin, generics.GenericAPIView):
     )
     def get(self, request, *args, **kwargs):
         """
-        View the list of users and the number of their posts.
+        View the list of users and the number of their posts, followers and subscriptions.
         """
         return self.list(request, *args, **kwargs)
 
 
+class UserProfileAPIView(generics.RetrieveAPIView):
+    """
+    View the user's profile: the number of his posts, followers and subscriptions.
+    """
+    queryset = UserModel.objects.all().only('id', 'email', 'posts_count', 'followers_count', 'following_count')
+    serializer_class = UserListSerializer
+    permission_classes = [AllowAny]
+
+    def get_object(self):
+        try:
+            return self.get_queryset().get(pk=self.kwargs.get('pk'))
+        except UserModel.DoesNotExist:
+            raise NotFound({'error': 'User not found'})
+
+
 class PostCreateAPIView(generics.CreateAPIView):
     """
     Allows the user to create new posts.
+    The new post is immediately delivered to the feeds of the user's followers.
+    Requires authentication.
+    """
+    serializer_class = PostSerializer
+    permission_classes = [IsAuthenticated]
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        post = serializer.save(owner=self.request.user)
+        feed_fan_out([post])
+
+
+class PostBulkCreateAPIView(generics.CreateAPIView):
+    """
+    Allows the user to create many posts in one request, pass the list of posts.
+    The posts are validated together and created only if all of them are valid,
+    otherwise the errors are returned for each post in the same order.
+    The posts are written with one bulk insert and delivered to the feeds of the user's followers at once.
+    At most POST_BULK_CREATE_MAX posts are accepted.
     Requires authentication.
     """
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_serializer(self, *args, **kwargs):
+        kwargs.update(many=True, allow_empty=False)
+        return super().get_serializer(*args, **kwargs)
+
+    @extend_schema(
+        request=PostSerializer(many=True),
+        responses={201: PostSerializer(many=True)},
+    )
+    def post(self, request, *args, **kwargs):
+        return self.create(request, *args, **kwargs)
+
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
+        posts = serializer.save(owner=self.request.user)
+        feed_fan_out(posts)
 
 
-class PostListAPIView(generics.ListAPIView):
+class PostListAPIView(PostFieldsMixin, generics.ListAPIView):
     """
     Allows you to view a list of other users posts.
+    The list is paginated with a cursor, newest posts first, the archived posts after the others.
+    The response has an ETag, a request with a matching If-None-Match header
+    gets 304 Not Modified without the list being queried.
     """
     serializer_class = PostSerializer
     permission_classes = [AllowAny]
+    pagination_class = PostsCursorPagination
+
+    @extend_schema(parameters=POST_FIELDS_PARAMETERS)
+    def get(self, request, *args, **kwargs):
+        version = posts_version(self.kwargs.get('pk'))
+        if version is None:
+            return self.list(request, *args, **kwargs)
+        etag = make_etag(request.build_absolute_uri(), *version)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = self.list(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
 
     def get_queryset(self):
+        return Post.objects.filter(owner_id=self.kwargs.get('pk')).select_related('owner')
+
+    def get_archive_queryset(self):
+        if settings.POST_ARCHIVE_AGE is None:
+            return None
+        return self.filter_queryset(ArchivedPost.objects.filter(owner_id=self.kwargs.get('pk')).
+                                    select_related('owner'))
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if not page and not UserModel.objects.filter(pk=self.kwargs.get('pk')).exists():
+            raise NotFound({'error': 'User not found'})
+        return page
+
+
+class PostExportAPIView(PostFieldsMixin, generics.GenericAPIView):
+    """
+    Exports all posts of the user as NDJSON, one post per line, newest posts first,
+    the archived posts after the others.
+    The posts are read from the database in chunks and streamed,
+    the memory used does not depend on the number of posts.
+    """
+    serializer_class = PostSerializer
+    permission_classes = [AllowAny]
+    pagination_class = None
+
+    @extend_schema(parameters=POST_FIELDS_PARAMETERS,
+                   responses={(200, 'application/x-ndjson'): PostSerializer})
+    def get(self, request, *args, **kwargs):
         pk = self.kwargs.get('pk')
-        if UserModel.objects.filter(pk=pk).exists():
-            return Post.objects.filter(owner_id=pk).select_related('owner')
-        else:
+        if not UserModel.objects.filter(pk=pk).exists():
             raise NotFound({'error': 'User not found'})
+        querysets = [self.filter_queryset(self.get_queryset())]
+        if settings.POST_ARCHIVE_AGE is not None:
+            querysets.append(self.filter_queryset(ArchivedPost.objects.filter(owner_id=pk).select_related('owner').
+                                                  order_by('-date_create', '-id')))
+        response = StreamingHttpResponse(self.stream(querysets, self.get_values_serializer()),
+                                         content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="posts-{pk}.ndjson"'
+        return response
 
+    def get_queryset(self):
+        return Post.objects.filter(owner_id=self.kwargs.get('pk')).select_related('owner'). \
+            order_by('-date_create', '-id')
 
-class FollowListCreateAPIView(mixins.CreateModelMixin, mixins.ListModelMixin,
+    @staticmethod
+    def stream(querysets, serializer):
+        """
+        Yields the lines of the posts of the querysets, a chunk of posts at a time.
+        """
+        chunk_size = settings.POST_EXPORT_CHUNK_SIZE
+        lines = []
+        for post in chain.from_iterable(queryset.iterator(chunk_size=chunk_size) for queryset in querysets):
+            lines.append(json.dumps(serializer.to_representation(post), cls=JSONEncoder, ensure_ascii=False))
+            if len(lines) == chunk_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+
+class PostSearchAPIView(PostFieldsMixin, generics.ListAPIView):
+    """
+    Full-text search of posts, pass the words to search for in the 'q' parameter.
+    The posts are found by the search index of the database and sorted by relevance,
+    the results are paginated with a cursor.
+    """
+    serializer_class = PostSerializer
+    permission_classes = [AllowAny]
+    pagination_class = SearchCursorPagination
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'error': 'Pass the search query in the "q" parameter'})
+        return search_posts(Post.objects.select_related('owner'), query)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(name='q', description='Words to search for in the title and text of the posts',
+                             required=True, type=str),
+            OpenApiParameter(name='cursor', description='The pagination cursor value', required=False, type=str),
+            *POST_FIELDS_PARAMETERS,
+        ],
+    )
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
+
+
+class FollowListCreateAPIView(StreamingListMixin, mixins.CreateModelMixin, mixins.ListModelMixin,
                               generics.GenericAPIView):
     """
     Allows you to subscribe to users, view the list of subscriptions.
+    Long lists of subscriptions are streamed.
     Requires authentication.
     """
     serializer_class = FollowingSerializer
@@ -108,12 +391,14 @@ class FollowListCreateAPIView(mixins.CreateModelMixin, mixins.ListModelMixin,
         """
         Subscribe to user.
         """
-        feed_create_or_add(self)
+        UserFeed.objects.get_or_create(user=request.user)
         return self.create(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         try:
-            serializer.save(user=self.request.user)
+            with transaction.atomic():
+                follow = serializer.save(user=self.request.user)
+                feed_follow(self.request.user.pk, follow.following_user_id)
         except IntegrityError:
             raise ValidationError({'error': 'You are already follow this user'})
 
@@ -129,17 +414,22 @@ class UnfollowAPIView(mixins.DestroyModelMixin, generics.GenericAPIView):
     """
     Allows you to unsubscribe to users.
     In order to unsubscribe from a user, you must pass his id in the request.
+    His posts disappear from the feed at once and are removed from it in the background.
     """
     permission_classes = [IsAuthenticated]
 
     def delete(self, request, *args, **kwargs):
 
         try:
-            feed_delete(self)
             return self.destroy(request, *args, **kwargs)
         except ObjectDoesNotExist:
             raise NotFound({'error': 'You are not following the user with this id'})
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        feed_delete(self)
+        instance.delete()
+
     def get_object(self):
         following_user = self.kwargs.get('following_user')
         return UserFollowing.objects.get(user=self.request.user, following_user=following_user)
@@ -150,40 +440,108 @@ class PostsFeedAPIListPagination(PageNumberPagination):
     Page pagination. The default is 10 posts per page.
     You can change the number of posts by passing the 'page_size' parameter.
     Max value = 100 posts per page.
+    If the view has get_archive_queryset(), the archived posts follow the posts of the queryset.
     """
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+    def paginate_queryset(self, queryset, request, view=None):
+        archive = view.get_archive_queryset() if hasattr(view, 'get_archive_queryset') else None
+        if archive is not None:
+            queryset = ArchiveChain(queryset, archive)
+        return super().paginate_queryset(queryset, request, view)
+
 
-class PostsFeedListAPIView(mixins.ListModelMixin, generics.GenericAPIView):
+class PostsFeedListAPIView(PostFieldsMixin, mixins.ListModelMixin, generics.GenericAPIView):
     """
     Allows you to view the feed of posts.
     You can filter the feed using the 'readed' parameter:
         ?readed=true will display only read posts from the feed.
         ?readed=false will only display unread posts from the feed.
         if the parameter is not passed in the request, then all posts will be displayed.
+    ?q=words displays only the posts of the feed matching the words.
+    ?fields= and ?excerpt= select the displayed fields of the posts (see PostFieldsMixin).
+    The feed is paginated by page numbers, ?pagination=cursor switches it to cursor pagination,
+    whose pages are read from the index of the feed, so deep pages cost the same as the first one.
+    The archived posts are listed after the others.
+    Posts are delivered to the feed when they are created, so reading the feed does not modify it,
+    unless it was updated longer ago than FEED_REFRESH_INTERVAL.
+    Pages are cached for FEED_CACHE_TIMEOUT seconds until the feed changes.
+    The response has an ETag, a request with a matching If-None-Match header gets 304 Not Modified.
     Requires authentication.
     """
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = PostsFeedAPIListPagination
 
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = FeedCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_feed(self):
+        if not hasattr(self, '_feed'):
+            self._feed = UserFeed.objects.filter(user=self.request.user).annotate(pulled=feed_cache_pulled()).first()
+        return self._feed
+
     def get_queryset(self):
         readed = self.request.query_params.get('readed')
-        obj = UserFeed.objects.get(user=self.request.user)
+        obj = self.get_feed()
+        if obj is None:
+            return Post.objects.none()
         if readed is None:
-            queryset = obj.feed.all().select_related('owner'). \
+            queryset = feed_posts(obj).select_related('owner'). \
                 only('id', 'title', 'text', 'date_create', 'owner__id', 'owner__email')
-            return queryset
         elif readed == 'true':
-            queryset = obj.read.all().select_related('owner'). \
+            queryset = feed_read_posts(obj).select_related('owner'). \
                 only('id', 'title', 'text', 'date_create', 'owner__id', 'owner__email')
-            return queryset
         elif readed == 'false':
-            queryset = obj.feed.exclude(id__in=obj.read.all()).select_related('owner'). \
+            queryset = feed_unread_posts(obj).select_related('owner'). \
                 only('id', 'title', 'text', 'date_create', 'owner__id', 'owner__email')
-            return queryset
+        else:
+            return None
+        query = self.request.query_params.get('q', '').strip()
+        if query:
+            queryset = search_posts(queryset, query, rank=False)
+        return queryset
+
+    def get_archive_queryset(self):
+        """
+        The archived posts follow the posts of the feed in both paginations, filtered by 'readed' the same way.
+        They are not searched.
+        """
+        obj = self.get_feed()
+        readed = self.request.query_params.get('readed')
+        if settings.POST_ARCHIVE_AGE is None or obj is None or self.request.query_params.get('q', '').strip():
+            return None
+        if readed is None:
+            queryset = feed_posts(obj, archive=True)
+        elif readed == 'true':
+            queryset = feed_read_posts(obj, archive=True)
+        elif readed == 'false':
+            queryset = feed_unread_posts(obj, archive=True)
+        else:
+            return None
+        return self.filter_queryset(queryset.select_related('owner').
+                                    only('id', 'title', 'text', 'date_create', 'owner__id', 'owner__email'))
+
+    def get_feed_keys(self):
+        """
+        The keys of the posts of the feed and the posts to read a cursor page from (see FeedCursorPagination),
+        filtered by 'readed'. None when the feed is searched.
+        """
+        obj = self.get_feed()
+        readed = self.request.query_params.get('readed')
+        if obj is None or self.request.query_params.get('q', '').strip() or readed not in (None, 'true', 'false'):
+            return None
+        posts = Post.objects.select_related('owner'). \
+            only('id', 'title', 'text', 'date_create', 'owner__id', 'owner__email')
+        return (*feed_keys(obj, None if readed is None else readed == 'true'), self.filter_queryset(posts))
 
     @extend_schema(
         parameters=[
@@ -211,29 +569,114 @@ class PostsFeedListAPIView(mixins.ListModelMixin, generics.GenericAPIView):
                                  ),
                              ],
                              ),
+            OpenApiParameter(name='q',
+                             description='Show only the posts matching these words',
+                             required=False,
+                             type=str,
+                             ),
+            OpenApiParameter(name='pagination',
+                             description='Pass "cursor" to paginate the feed with a cursor instead of page numbers',
+                             required=False,
+                             type=str,
+                             enum=['cursor'],
+                             ),
+            OpenApiParameter(name='cursor',
+                             description='The pagination cursor value, used with ?pagination=cursor',
+                             required=False,
+                             type=str,
+                             ),
+            *POST_FIELDS_PARAMETERS,
         ],
     )
     def get(self, request, *args, **kwargs):
-        feed_create_or_add(self)
-        return self.list(request, *args, **kwargs)
+        obj = self.get_feed()
+        if obj is not None:
+            feed_refresh(obj)
+        if obj is None:
+            return self.list(request, *args, **kwargs)
+        key = feed_cache_key(request, obj)
+        etag = make_etag(key)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        data = feed_cache_get(key) if settings.FEED_CACHE_TIMEOUT else None
+        if data is not None:
+            response = Response(data)
+        else:
+            response = self.list(request, *args, **kwargs)
+            if settings.FEED_CACHE_TIMEOUT:
+                feed_cache_set(key, response.data)
+        response['ETag'] = etag
+        return response
 
 
 class PostFeedRetrieveAPIView(generics.RetrieveAPIView):
     """
-    Allows you to add posts to the "read" field of the feed.
-    If the post has already been added, displays information about the post.
+    Displays information about a post of the feed and marks it as read.
+    The post and its read state are fetched in one query, the post is added to the "read" field
+    of the feed only if it is not read yet.
     Requires authentication.
     """
     queryset = Post.objects.all()
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_object(self):
+        for archive in feed_archives():
+            post = feed_get_post(self.request.user.pk, self.kwargs.get('pk'), archive)
+            if post is not None:
+                return post
+        raise NotFound({'error': 'Post not found in your feed'})
+
     def get(self, request, *args, **kwargs):
-        user_feed = UserFeed.objects.get(pk=self.request.user.pk)
-        pk = self.kwargs.get('pk')
-        if pk in user_feed.feed.values_list("id", flat=True):
-            if pk not in user_feed.read.values_list("id", flat=True):
-                user_feed.read.add(pk)
-        else:
-            raise NotFound({'error': 'Post not found in your feed'})
-        return self.retrieve(request, *args, **kwargs)
+        post = self.get_object()
+        if not post.is_read:
+            feed_mark_read(request.user.pk, [post.pk], archive=isinstance(post, ArchivedPost))
+        serializer = self.get_serializer(post)
+        return Response(serializer.data)
+
+
+class PostsFeedReadAPIView(generics.GenericAPIView):
+    """
+    Allows you to mark many posts of the feed as read in one request.
+    Pass the list of post "ids" (only posts from your feed are marked),
+    or "until" to mark all posts created before or at this moment.
+    Requires authentication.
+    """
+    serializer_class = FeedReadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            obj = UserFeed.objects.get(user=self.request.user)
+        except UserFeed.DoesNotExist:
+            raise NotFound({'error': 'You have no feed yet'})
+        if 'ids' in serializer.validated_data:
+            ids = []
+            for archive in feed_archives():
+                unread = list(feed_unread_posts(obj, archive).filter(id__in=serializer.validated_data['ids']).
+                              values_list('id', flat=True))
+                feed_mark_read(obj.pk, unread, archive)
+                ids += unread
+            return Response({'ids': ids})
+        feed_mark_read_until(obj, serializer.validated_data['until'])
+        return Response(self.get_serializer(serializer.validated_data).data)
+
+
+class PostsFeedUnreadAPIView(generics.GenericAPIView):
+    """
+    Displays the number of unread posts in the feed.
+    The number is kept up to date with the feed and read by the primary key in a single query.
+    When FEED_FAN_OUT_THRESHOLD is set, the unread not pushed posts of high-follower users are not in the counter,
+    the query counts them with subqueries over these users' posts created since the subscription,
+    so the request costs more the more such posts are followed.
+    Requires authentication.
+    """
+    serializer_class = FeedUnreadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer({'unread_count': feed_unread_total(request.user.pk)})
+        return Response(serializer.data)
@@ -83,11 +83,11 @@ class BlogAPITestCase(APITestCase):
         url = reverse('user_posts', args=(self.user.pk,))
         response = self.client.get(url)
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(self.user.posts.count(), len(response.data))
+        self.assertEqual(self.user.posts.count(), len(response.data['results']))
         url = reverse('user_posts', args=(self.user2.pk,))
         response = self.client.get(url)
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(self.user2.posts.count(), len(response.data))
+        self.assertEqual(self.user2.posts.count(), len(response.data['results']))
 
         #  Subscribe to user posts.
         url = reverse('follow')
@@ -114,10 +114,19 @@ class BlogAPITestCase(APITestCase):
         self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
         self.assertEqual(2, UserFollowing.objects.filter(user__email=email).count())
 
+        #  New posts of followed users are delivered to the feed.
+        url = reverse('post_create')
+        author = APIClient()
+        author.force_authenticate(self.user)
         for j in range(5, 12):
-            self.user.posts.create(title=f'{self.user} title{j}', text=f'{self.user} Test text{j}')
+            data = {'title': f'{self.user} title{j}', 'text': f'{self.user} Test text{j}'}
+            response = author.post(url, data=json.dumps(data), content_type='application/json')
+            self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        author.force_authenticate(self.user3)
         for i in range(6, 15):
-            self.user3.posts.create(title=f'{self.user3} title{i}', text=f'{self.user3} Test text{i}')
+            data = {'title': f'{self.user3} title{i}', 'text': f'{self.user3} Test text{i}'}
+            response = author.post(url, data=json.dumps(data), content_type='application/json')
+            self.assertEqual(status.HTTP_201_CREATED, response.status_code)
 
         #  Get feed from user posts, on which have been subscribed.
         #  The list of posts is given in pages of 10 pieces.